@@ -1,4 +1,3 @@
-from csv import writer
 from mimetypes import guess_type
 from os.path import join
 from cStringIO import StringIO
@@ -9,16 +8,23 @@ from django.contrib import admin
 from django.core.files.storage import FileSystemStorage
 from django.core.urlresolvers import reverse
 from django.db.models import Count
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import (HttpResponse, HttpResponseRedirect,
+                         StreamingHttpResponse)
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
 from django.utils.translation import ungettext, ugettext_lazy as _
 
+from forms_builder.forms.caching import flush_version_bumps
 from forms_builder.forms.forms import EntriesForm
 from forms_builder.forms.models import Form, Field, FormEntry, FieldEntry, UserEntry
-from forms_builder.forms.settings import CSV_DELIMITER, UPLOAD_ROOT
+from forms_builder.forms.models import ROLLUP_DAY, ROLLUP_HOUR
+from forms_builder.forms.settings import CSV_DELIMITER, CSV_ENCODING
+from forms_builder.forms.settings import UPLOAD_ROOT
 from forms_builder.forms.settings import USE_SITES, EDITABLE_SLUGS
-from forms_builder.forms.utils import now, slugify
+from forms_builder.forms.settings import USE_ROLLUPS, USE_TALLIES
+from forms_builder.forms.rollups import remove_entry_rollups, rollup_series
+from forms_builder.forms.tallies import remove_entry_tallies
+from forms_builder.forms.utils import atomic, csv_stream, now, slugify
 
 try:
     import xlwt
@@ -83,6 +89,43 @@ class FormAdmin(admin.ModelAdmin):
         qs = super(FormAdmin, self).queryset(request)
         return qs.annotate(total_entries=Count("entries"))
 
+    def add_view(self, *args, **kwargs):
+        """
+        Issue the form's new cache versions again once the view's
+        transaction is committed.
+        """
+        response = super(FormAdmin, self).add_view(*args, **kwargs)
+        flush_version_bumps()
+        return response
+
+    def change_view(self, request, object_id, *args, **kwargs):
+        """
+        Add hourly and daily series of the form's submissions to the
+        change view when ``USE_ROLLUPS`` is enabled, and issue the
+        form's new cache versions again once the view's transaction is
+        committed.
+        """
+        extra_context = kwargs.pop("extra_context", None) or {}
+        if USE_ROLLUPS:
+            form = self.model(id=object_id)
+            extra_context["hourly_submissions"] = rollup_series(form,
+                ROLLUP_HOUR, 48)
+            extra_context["daily_submissions"] = rollup_series(form,
+                ROLLUP_DAY, 30)
+        response = super(FormAdmin, self).change_view(request, object_id,
+            *args, extra_context=extra_context, **kwargs)
+        flush_version_bumps()
+        return response
+
+    def delete_view(self, *args, **kwargs):
+        """
+        Issue the form's new cache versions again once the view's
+        transaction is committed.
+        """
+        response = super(FormAdmin, self).delete_view(*args, **kwargs)
+        flush_version_bumps()
+        return response
+
     def get_urls(self):
         """
         Add the entries view to urls.
@@ -101,6 +144,9 @@ class FormAdmin(admin.ModelAdmin):
             url("^file/(?P<field_entry_id>\d+)/$",
                 self.admin_site.admin_view(self.file_view),
                 name="form_file"),
+            url("^file/(?P<entry_id>\d+)/(?P<field_id>\d+)/$",
+                self.admin_site.admin_view(self.entry_file_view),
+                name="form_entry_file"),
         )
         return extra_urls + urls
 
@@ -125,19 +171,16 @@ class FormAdmin(admin.ModelAdmin):
         export_xls = export_xls or request.POST.get("export_xls")
         if submitted:
             if export:
-                response = HttpResponse(mimetype="text/csv")
+                # Stream the rows encoded with a byte order mark
+                # to be Excel compatible.
+                content = csv_stream(entries_form.columns(),
+                                     entries_form.rows(csv=True),
+                                     CSV_DELIMITER, CSV_ENCODING)
+                response = StreamingHttpResponse(content,
+                                                 content_type="text/csv")
                 fname = "%s-%s.csv" % (form.slug, slugify(now().ctime()))
                 attachment = "attachment; filename=%s" % fname
                 response["Content-Disposition"] = attachment
-                queue = StringIO()
-                csv = writer(queue, delimiter=CSV_DELIMITER)
-                csv.writerow(entries_form.columns())
-                for row in entries_form.rows(csv=True):
-                    csv.writerow(row)
-                # Decode and reencode entire queued response
-                # into utf-16 to be Excel compatible
-                data = queue.getvalue().decode("utf-8").encode("utf-16")
-                response.write(data)
                 return response
             elif XLWT_INSTALLED and export_xls:
                 response = HttpResponse(mimetype="application/vnd.ms-excel")
@@ -171,8 +214,15 @@ class FormAdmin(admin.ModelAdmin):
                     entries = FormEntry.objects.filter(id__in=selected)
                     count = entries.count()
                     if count > 0:
-                        UserEntry.objects.filter(entry=entries[0]).delete()
-                        entries.delete()
+                        with atomic():
+                            if USE_TALLIES:
+                                remove_entry_tallies(form, selected,
+                                                     self.fieldentry_model)
+                            if USE_ROLLUPS:
+                                remove_entry_rollups(form, selected,
+                                                     self.formentry_model)
+                            UserEntry.objects.filter(entry=entries[0]).delete()
+                            entries.delete()
                         message = ungettext("1 entry deleted",
                                             "%(count)s entries deleted", count)
                         info(request, message % {"count": count})
@@ -190,7 +240,23 @@ class FormAdmin(admin.ModelAdmin):
         """
         model = self.fieldentry_model
         field_entry = get_object_or_404(model, id=field_entry_id)
-        path = join(fs.location, field_entry.value)
+        return self.file_response(field_entry.value)
+
+    def entry_file_view(self, request, entry_id, field_id):
+        """
+        Output the file for the requested field of an entry.
+        """
+        model = self.fieldentry_model
+        field_entry = get_object_or_404(model, entry_id=entry_id,
+                                        field_id=field_id)
+        return self.file_response(field_entry.value)
+
+    def file_response(self, name):
+        """
+        Return a response with the uploaded file of the given name as an
+        attachment.
+        """
+        path = join(fs.location, name)
         response = HttpResponse(mimetype=guess_type(path)[0])
         f = open(path, "r+b")
         response["Content-Disposition"] = "attachment; filename=%s" % f.name
@@ -0,0 +1,83 @@
+from threading import local
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import connection, connections, router
+
+from forms_builder.forms.settings import CACHE_PREFIX
+
+
+def cache_key(*bits):
+    """
+    Build a cache key from the given bits, namespaced with the
+    ``CACHE_PREFIX`` setting.
+    """
+    return ".".join([CACHE_PREFIX] + [unicode(bit) for bit in bits])
+
+
+def form_version_key(form, scope="form"):
+    """
+    Key storing the current version token for the given form, or the
+    given form model class when used for model-wide versions. The scope
+    allows separate versions to be kept for data that changes at a
+    different rate to the form itself, such as its entries.
+    """
+    opts = form._meta
+    pk = "all" if isinstance(form, type) else form.pk
+    return cache_key("version", scope, opts.app_label, opts.object_name, pk)
+
+
+def get_form_version(form, scope="form"):
+    """
+    Return the current version token for the given form. Tokens are
+    random rather than incremented, so that a token evicted from the
+    cache can never be reissued and match stale cached data. When the
+    cache doesn't keep the new token, such as with the dummy backend,
+    it's still returned, so nothing is found cached under it.
+    """
+    key = form_version_key(form, scope)
+    version = cache.get(key)
+    if version is None:
+        version = uuid4().hex
+        cache.add(key, version, None)
+        version = cache.get(key) or version
+    return version
+
+
+# Version keys bumped inside transactions, for the current thread.
+_pending = local()
+
+
+def bump_form_version(form, scope="form"):
+    """
+    Issue a new version token for the given form, invalidating
+    everything cached under the previous one. A request reading the
+    old rows before the transaction writing the new ones is committed
+    would cache them under the new token, so tokens issued inside a
+    transaction are issued again by ``flush_version_bumps``.
+    """
+    key = form_version_key(form, scope)
+    cache.set(key, uuid4().hex, None)
+    model = form if isinstance(form, type) else form.__class__
+    if connections[router.db_for_write(model)].in_atomic_block:
+        if getattr(_pending, "keys", None) is None:
+            _pending.keys = set()
+        _pending.keys.add(key)
+
+
+def flush_version_bumps(**kwargs):
+    """
+    Issue new tokens for the versions bumped inside transactions, once
+    they're committed. Called by writers after their transaction, and
+    connected to ``request_finished`` for all other writes in requests.
+    Does nothing while still inside a transaction.
+    """
+    keys = getattr(_pending, "keys", None)
+    if not keys or connection.in_atomic_block:
+        return
+    _pending.keys = None
+    cache.set_many(dict([(key, uuid4().hex) for key in keys]), None)
+
+
+request_finished.connect(flush_version_bumps)
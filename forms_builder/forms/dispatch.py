@@ -0,0 +1,211 @@
+import logging
+from Queue import Full, Queue
+from threading import Lock, Thread, local
+from time import time
+from weakref import ReferenceType
+
+from django.core.signals import (got_request_exception, request_finished,
+                                 request_started)
+from django.db import close_old_connections, connection
+from django.dispatch.saferef import BoundMethodWeakref
+
+from forms_builder.forms import settings
+
+
+logger = logging.getLogger("forms_builder")
+
+
+def synchronous(receiver):
+    """
+    Decorator for a signal receiver that must always run during the
+    request, even when receivers are dispatched to worker threads.
+    """
+    receiver.forms_builder_synchronous = True
+    return receiver
+
+
+class ReceiverMetrics(object):
+    """
+    Thread-safe timings for each receiver run by ``send``.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.receivers = {}
+
+    def record(self, receiver, duration, error):
+        name = "%s.%s" % (getattr(receiver, "__module__", ""),
+                          getattr(receiver, "__name__", repr(receiver)))
+        with self.lock:
+            stats = self.receivers.setdefault(name, {"calls": 0, "errors": 0,
+                "timeouts": 0, "total_time": 0.0, "max_time": 0.0})
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["timeouts"] += int(duration > settings.SIGNAL_TIMEOUT)
+            stats["total_time"] += duration
+            stats["max_time"] = max(stats["max_time"], duration)
+
+    def snapshot(self):
+        """
+        Return a copy of the timings, keyed by receiver name.
+        """
+        with self.lock:
+            return dict([(name, dict(stats))
+                         for name, stats in self.receivers.items()])
+
+metrics = ReceiverMetrics()
+
+
+def call_receiver(receiver, signal, sender, kwargs):
+    """
+    Run a receiver with its errors isolated from the sender and other
+    receivers, recording its timing.
+    """
+    start = time()
+    error = False
+    try:
+        receiver(signal=signal, sender=sender, **kwargs)
+    except Exception:
+        error = True
+        logger.exception("Signal receiver %r failed" % receiver)
+    duration = time() - start
+    if duration > settings.SIGNAL_TIMEOUT:
+        logger.warning("Signal receiver %r took %.3fs" % (receiver, duration))
+    metrics.record(receiver, duration, error)
+
+
+class DispatchPool(object):
+    """
+    A bounded pool of daemon threads running receiver calls. Python
+    threads can't be interrupted, so a receiver exceeding the timeout
+    is logged and counted rather than stopped. When the queue is full,
+    calls run in the calling thread instead, slowing the request down
+    rather than queueing without limit.
+    """
+
+    def __init__(self, size, queue_size):
+        self.size = size
+        self.queue = Queue(queue_size)
+        self.threads = []
+        self.lock = Lock()
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.size:
+                thread = Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def work(self):
+        while True:
+            args = self.queue.get()
+            try:
+                call_receiver(*args)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+    def submit(self, *args):
+        if len(self.threads) < self.size:
+            self.start()
+        try:
+            self.queue.put_nowait(args)
+        except Full:
+            call_receiver(*args)
+
+    def join(self):
+        """
+        Block until every submitted receiver call has finished.
+        """
+        self.queue.join()
+
+pool = DispatchPool(settings.SIGNAL_THREADS, settings.SIGNAL_QUEUE_SIZE)
+
+# Receiver calls deferred until the request's transaction is committed.
+pending = local()
+
+
+def start_request(**kwargs):
+    pending.calls = []
+
+
+def drop_pending(**kwargs):
+    """
+    Drop the receiver calls deferred during a request that raised an
+    exception, since its transaction has been rolled back.
+    """
+    pending.calls = None
+
+
+def flush_pending(**kwargs):
+    """
+    Submit receiver calls deferred during the request to the pool,
+    once its transaction has been committed.
+    """
+    calls = getattr(pending, "calls", None)
+    pending.calls = None
+    for args in calls or ():
+        pool.submit(*args)
+
+request_started.connect(start_request)
+got_request_exception.connect(drop_pending)
+request_finished.connect(flush_pending)
+
+
+def defer(receiver, signal, sender, kwargs):
+    """
+    Run a receiver call on the pool, straight away outside of a
+    transaction, or inside a request's transaction once the request
+    finishes, which commits it. Calls inside any other transaction,
+    whose outcome isn't known here, run in the calling thread.
+    """
+    args = (receiver, signal, sender, kwargs)
+    if not connection.in_atomic_block:
+        pool.submit(*args)
+    elif getattr(pending, "calls", None) is not None:
+        pending.calls.append(args)
+    else:
+        call_receiver(*args)
+
+
+def live_receivers(signal, sender):
+    """
+    Return the receivers connected to the signal for the given sender
+    or for any sender, in the order they were connected, dereferencing
+    the weak references held in the signal's ``receivers`` list.
+    """
+    sender_keys = (id(None), id(sender))
+    receivers = []
+    for (receiver_key, sender_key), receiver in list(signal.receivers):
+        if sender_key not in sender_keys:
+            continue
+        if isinstance(receiver, (ReferenceType, BoundMethodWeakref)):
+            receiver = receiver()
+            if receiver is None:
+                continue
+        receivers.append(receiver)
+    return receivers
+
+
+def send(signal, sender, **kwargs):
+    """
+    Send a signal according to the ``SIGNAL_DISPATCH`` setting. When
+    threaded, receivers decorated with ``synchronous`` run immediately
+    in the order they were connected, and all others are handed to
+    ``defer``. Returns the responses of the receivers that ran.
+    """
+    if settings.SIGNAL_DISPATCH != "threaded":
+        return signal.send(sender=sender, **kwargs)
+    responses = []
+    for receiver in live_receivers(signal, sender):
+        if getattr(receiver, "forms_builder_synchronous", False):
+            response = receiver(signal=signal, sender=sender, **kwargs)
+            responses.append((receiver, response))
+        else:
+            defer(receiver, signal, sender, kwargs)
+    return responses
@@ -1,20 +1,32 @@
-from datetime import date, datetime
+from datetime import datetime, timedelta
+from operator import and_
 from os.path import join, split
 from uuid import uuid4
 
 import django
 from django import forms
+from django.conf import settings as django_settings
 from django.forms.extras import SelectDateWidget
 from django.core.files.storage import FileSystemStorage
 from django.core.urlresolvers import reverse
+from django.db.models import Q
 from django.template import Template
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
 from forms_builder.forms import fields
+from forms_builder.forms.caching import flush_version_bumps
 from forms_builder.forms.models import FormEntry, FieldEntry, UserEntry, STATUS_PUBLIC
+from forms_builder.forms.models import TYPED_VALUE_FIELDS, parse_typed_values
+from forms_builder.forms.models import dump_entry_data, load_entry_data
+from forms_builder.forms.models import Selection, value_hash
 from forms_builder.forms import settings
-from forms_builder.forms.utils import now, split_choices
+from forms_builder.forms.rollups import apply_rollups, count_entries
+from forms_builder.forms.schema import get_form_schema
+from forms_builder.forms.tallies import apply_tallies, count_values
+from forms_builder.forms.utils import (atomic, bulk_update, exists, now,
+                                       split_choices)
 
 from django.contrib.auth.models import AnonymousUser
 
@@ -104,6 +116,18 @@ FILTER_FUNCS = {
         lambda val, field: set(val) != set(split_choices(field)),
 }
 
+
+def day_start(day):
+    """
+    Return the start of the given date in the current time zone, as
+    compared with the typed ``date_value`` of field entries.
+    """
+    start = datetime(day.year, day.month, day.day)
+    if django_settings.USE_TZ:
+        start = timezone.make_aware(start, timezone.get_current_timezone())
+    return start
+
+
 # Export form fields for each filter type grouping
 text_filter_field = forms.ChoiceField(label=" ", required=False,
                                       choices=TEXT_FILTER_CHOICES)
@@ -115,8 +139,27 @@ date_filter_field = forms.ChoiceField(label=" ", required=False,
                                       choices=DATE_FILTER_CHOICES)
 
 
+# Argument names accepted by each form field class, keyed by class.
+_field_arg_names = {}
+
+
+def field_arg_names(field_class):
+    """
+    Return the argument names accepted by the given form field class's
+    constructor, inspecting each class only once.
+    """
+    try:
+        return _field_arg_names[field_class]
+    except KeyError:
+        arg_names = field_class.__init__.im_func.func_code.co_varnames
+        _field_arg_names[field_class] = arg_names
+        return arg_names
+
+
 class FormForForm(forms.ModelForm):
     field_entry_model = FieldEntry
+    user_entry_model = UserEntry
+    selection_model = Selection
 
     class Meta:
         model = FormEntry
@@ -125,17 +168,23 @@ class FormForForm(forms.ModelForm):
     def __init__(self, form, context, *args, **kwargs):
         """
         Dynamically add each of the form fields for the given form model
-        instance and its related field model instances.
+        instance, using the compiled schema of its visible fields.
         """
         self.form = form
-        self.form_fields = form.fields.visible()
+        self.form_fields = get_form_schema(form).fields
         initial = kwargs.pop("initial", {})
         # If a FormEntry instance is given to edit, stores it's field
-        # values for using as initial data.
+        # values for using as initial data, along with the IDs of their
+        # FieldEntry rows for updating them when saved.
         field_entries = {}
+        self.field_entry_ids = {}
         if kwargs.get("instance"):
-            for field_entry in kwargs["instance"].fields.all():
-                field_entries[field_entry.field_id] = field_entry.value
+            field_entry_rows = kwargs["instance"].fields.values_list(
+                "id", "field_id", "value")
+            for field_entry_id, field_id, value in field_entry_rows:
+                field_entries[field_id] = value
+                self.field_entry_ids[field_id] = field_entry_id
+        self.field_entries = field_entries
         super(FormForForm, self).__init__(*args, **kwargs)
         # Create the form fields.
         for field in self.form_fields:
@@ -144,11 +193,11 @@ class FormForForm(forms.ModelForm):
             field_widget = fields.WIDGETS.get(field.field_type)
             field_args = {"label": field.label, "required": field.required,
                           "help_text": field.help_text}
-            arg_names = field_class.__init__.im_func.func_code.co_varnames
+            arg_names = field_arg_names(field_class)
             if "max_length" in arg_names:
                 field_args["max_length"] = settings.FIELD_MAX_LENGTH
             if "choices" in arg_names:
-                field_args["choices"] = field.get_choices()
+                field_args["choices"] = field.choices
             if field_widget is not None:
                 field_args["widget"] = field_widget
             #
@@ -169,7 +218,9 @@ class FormForForm(forms.ModelForm):
                 try:
                     initial_val = initial[field_key]
                 except KeyError:
-                    initial_val = Template(field.default).render(context)
+                    initial_val = field.default
+                    if field.default_is_template:
+                        initial_val = Template(initial_val).render(context)
             if initial_val:
                 if field.is_a(*fields.MULTIPLE):
                     initial_val = split_choices(initial_val)
@@ -195,30 +246,12 @@ class FormForForm(forms.ModelForm):
                 text = field.placeholder_text
                 self.fields[field_key].widget.attrs["placeholder"] = text
 
-    def save(self, user=None, **kwargs):
+    def field_values(self):
         """
-        Get/create a FormEntry instance and assign submitted values to
-        related FieldEntry instances for each form field.
+        Return a list of (field, value) pairs holding the value to store
+        for each form field, saving any uploaded files to storage.
         """
-        entry = super(FormForForm, self).save(commit=False)
-        entry.form = self.form
-        entry.entry_time = now()
-        entry.save()
-
-        if self.form.can_submit_status != STATUS_PUBLIC:
-            user_entry = UserEntry()
-            user_entry.user = user
-            user_entry.form = self.form
-            if self.form.anonymous_vote is False:
-                user_entry.entry = entry
-            try:
-                user_entry.save()
-            except:
-                entry.delete()
-                raise
-
-        entry_fields = entry.fields.values_list("field_id", flat=True)
-        new_entry_fields = []
+        values = []
         for field in self.form_fields:
             field_key = field.slug
             value = self.cleaned_data[field_key]
@@ -226,20 +259,164 @@ class FormForForm(forms.ModelForm):
                 value = fs.save(join("forms", str(uuid4()), value.name), value)
             if isinstance(value, list):
                 value = ", ".join([v.strip() for v in value])
-            if field.id in entry_fields:
-                field_entry = entry.fields.get(field_id=field.id)
-                field_entry.value = value
-                field_entry.save()
+            values.append((field, value))
+        return values
+
+    def save(self, user=None, **kwargs):
+        """
+        Create a FormEntry instance with related FieldEntry instances for
+        each form field, or update them when editing an existing entry.
+
+        Uploaded files are stored before any rows are written, and all
+        rows are then written in a single transaction. With ``ENTRY_DATA``
+        enabled, the values are also stored as JSON on the FormEntry
+        without any further queries. Creating an entry takes a fixed
+        number of queries: one INSERT for the FormEntry, one for the
+        UserEntry on non-public forms, and one bulk INSERT for all
+        FieldEntry rows (split into batches only on backends
+        that limit query parameters, such as SQLite), plus one for the
+        Selection rows of any fields accepting multiple choices. Editing
+        an entry takes one UPDATE for the FormEntry and one bulk UPDATE
+        for the changed FieldEntry rows, and replaces the Selection rows
+        of changed multiple choice fields. The number of FieldEntry rows written
+        is stored in ``rows_written``.
+        """
+        entry = super(FormForForm, self).save(commit=False)
+        entry.form = self.form
+        previous_entry_time = entry.entry_time if entry.pk else None
+        entry.entry_time = now()
+        values = self.field_values()
+        if settings.ENTRY_DATA or entry.data is not None:
+            self.set_entry_data(entry, values)
+        with atomic():
+            if entry.pk is None:
+                entry.save()
+                if self.form.can_submit_status != STATUS_PUBLIC:
+                    self.save_user_entry(entry, user)
+                self.create_field_entries(entry, values)
+                self.create_selections(entry, [f for f, v in values])
+                self.rows_written = len(values)
             else:
-                new = {"entry": entry, "field_id": field.id, "value": value}
-                new_entry_fields.append(self.field_entry_model(**new))
+                entry.save()
+                self.rows_written = self.update_field_entries(entry, values)
+            if settings.USE_TALLIES:
+                self.update_tallies(values)
+            if settings.USE_ROLLUPS:
+                deltas = count_entries([entry.entry_time])
+                if previous_entry_time is not None:
+                    count_entries([previous_entry_time], deltas, sign=-1)
+                apply_rollups(self.form, deltas)
+        flush_version_bumps()
+        return entry
+
+    def update_tallies(self, values):
+        """
+        Count the entry's choices in the form's tallies, replacing the
+        previous choices of an edited entry.
+        """
+        value_field = self.field_entry_model._meta.get_field("value")
+        rows = [(field.id, value_field.get_prep_value(value), 1)
+                for field, value in values]
+        deltas = count_values(self.form_fields, rows)
+        old_rows = [(field_id, value, 1) for field_id, value
+                    in getattr(self, "field_entries", {}).items()]
+        count_values(self.form_fields, old_rows, deltas, sign=-1)
+        apply_tallies(self.form, deltas)
+
+    def set_entry_data(self, entry, values):
+        """
+        Store the values of all of the entry's fields as JSON on the
+        entry, merged with any stored values of fields not in the form.
+        """
+        value_field = self.field_entry_model._meta.get_field("value")
+        if entry.data is not None:
+            data = load_entry_data(entry.data)
+        else:
+            data = dict(getattr(self, "field_entries", {}))
+        for field, value in values:
+            data[field.id] = value_field.get_prep_value(value)
+        entry.data = dump_entry_data(data)
+
+    def save_user_entry(self, entry, user):
+        """
+        Record the user's vote, raising ``IntegrityError`` if they have
+        already submitted the form.
+        """
+        user_entry = self.user_entry_model(user=user, form=self.form)
+        if self.form.anonymous_vote is False:
+            user_entry.entry = entry
+        user_entry.save()
+
+    def create_field_entries(self, entry, values):
+        """
+        Insert the FieldEntry rows for a new entry, filling their typed
+        value columns.
+        """
+        value_field = self.field_entry_model._meta.get_field("value")
+        new_entry_fields = []
+        for field, value in values:
+            value = value_field.get_prep_value(value)
+            new = {"entry": entry, "field_id": field.id, "value": value}
+            field_entry = self.field_entry_model(**new)
+            field_entry.set_typed_values(field.field_type)
+            new_entry_fields.append(field_entry)
         if new_entry_fields:
             if django.VERSION >= (1, 4, 0):
                 self.field_entry_model.objects.bulk_create(new_entry_fields)
             else:
                 for field_entry in new_entry_fields:
                     field_entry.save()
-        return entry
+
+    def update_field_entries(self, entry, values):
+        """
+        Update the FieldEntry rows of an existing entry, using the rows
+        loaded when the form was created. Only rows whose value changed
+        are written, along with their typed value columns, all with a
+        single bulk UPDATE, and any missing rows are created. Returns the
+        number of rows written.
+        """
+        value_field = self.field_entry_model._meta.get_field("value")
+        changed = {}
+        changed_fields = []
+        new_values = []
+        for field, value in values:
+            try:
+                field_entry_id = self.field_entry_ids[field.id]
+            except KeyError:
+                new_values.append((field, value))
+                changed_fields.append(field)
+                continue
+            value = value_field.get_prep_value(value)
+            if value != self.field_entries[field.id]:
+                changed[field_entry_id] = parse_typed_values(field.field_type,
+                                                             value)
+                changed[field_entry_id]["value"] = value
+                changed_fields.append(field)
+        bulk_update(self.field_entry_model, changed,
+                    ("value",) + TYPED_VALUE_FIELDS)
+        self.create_field_entries(entry, new_values)
+        changed_fields = [f for f in changed_fields if f.is_a(*fields.MULTIPLE)]
+        if changed_fields:
+            self.selection_model.objects.filter(entry=entry,
+                field_id__in=[f.id for f in changed_fields]).delete()
+            self.create_selections(entry, changed_fields)
+        return len(changed) + len(new_values)
+
+    def create_selections(self, entry, form_fields):
+        """
+        Insert a Selection row for each option chosen in the given
+        fields that accept multiple choices.
+        """
+        selections = []
+        for field in form_fields:
+            if field.is_a(*fields.MULTIPLE):
+                for value in self.cleaned_data[field.slug]:
+                    value = value.strip()
+                    selections.append(self.selection_model(entry=entry,
+                        field_id=field.id, value=value,
+                        value_hash=value_hash(value)))
+        if selections:
+            self.selection_model.objects.bulk_create(selections)
 
     def email_to(self):
         """
@@ -257,6 +434,8 @@ class EntriesForm(forms.Form):
     filter entries for the given ``forms.models.Form`` instance.
     """
 
+    selection_model = Selection
+
     def __init__(self, form, request, formentry_model=FormEntry,
                  fieldentry_model=FieldEntry, userentry_model=UserEntry, *args, **kwargs):
         """
@@ -376,7 +555,13 @@ class EntriesForm(forms.Form):
 
     def rows(self, csv=False):
         """
-        Returns each row based on the selected criteria.
+        Yield a tuple of the selected columns for each entry matching
+        the selected criteria, newest first. Entries are read in batches
+        by ``entry_values``, so memory use is flat regardless of the
+        number of entries, and rows can be streamed to any consumer,
+        such as the ``export_form_entries`` management command. Unless
+        ``csv`` is true, each row starts with the entry's ID and file
+        fields are rendered as links.
         """
 
         # Store the index of each field against its ID for building each
@@ -391,8 +576,8 @@ class EntriesForm(forms.Form):
                 field_indexes[field.id] = len(field_indexes)
                 if field.is_a(fields.FILE):
                     file_field_ids.append(field.id)
-                elif field.is_a(*fields.DATES):
-                    date_field_ids.append(field.id)
+            if field.is_a(*fields.DATES):
+                date_field_ids.append(field.id)
         num_columns = len(field_indexes)
 
         include_entry_time = self.posted_data("field_0_export")
@@ -400,88 +585,258 @@ class EntriesForm(forms.Form):
         #if include_entry_time:
         #    num_columns += 1
 
-        # Get the field entries for the given form and filter by entry_time
-        # if specified.
-        model = self.fieldentry_model
-        field_entries = model.objects.filter(entry__form=self.form
-        ).order_by("-entry__id").select_related(depth=1)
-        if self.posted_data("field_0_filter") == FILTER_CHOICE_BETWEEN:
-            time_from = self.posted_data("field_0_from")
-            time_to = self.posted_data("field_0_to")
-            if time_from and time_to:
-                field_entries = field_entries.filter(
-                    entry__entry_time__range=(time_from, time_to))
-
-
-
-        # Loop through each field value ordered by entry, building up each
-        # entry as a row. Use the ``valid_row`` flag for marking a row as
+        # Loop through the values of each entry, building up each entry
+        # as a row. Use the ``valid_row`` flag for marking a row as
         # invalid if it fails one of the filtering criteria specified.
-        current_entry = None
-        current_row = None
-        valid_row = True
-        for field_entry in field_entries:
-            if field_entry.entry_id != current_entry:
-                # New entry, write out the current row and start a new one.
-                if valid_row and current_row is not None:
-                    if not csv:
-                        current_row.insert(0, current_entry)
-                    yield current_row
-                current_entry = field_entry.entry_id
-                current_row = [""] * num_columns
-                valid_row = True
-                if include_entry_time:
-                    current_row.append(field_entry.entry.entry_time)
-                if include_user:
-                    user_found = False
-                    for e in UserEntry.objects.all():
-                        if (e.entry == field_entry.entry):
-                            current_row.append(e.user)
-                            user_found = True
+        # Only read the values of fields that are exported or filtered.
+        field_ids = [field.id for field in self.form_fields
+                     if field.id in field_indexes or
+                     self.field_filter(field.id)[1]]
+        for entry_id, entry_time, values, user in self.entry_values(
+                field_ids=field_ids, users=include_user):
+            current_row = [""] * num_columns
+            valid_row = True
+            if include_entry_time:
+                current_row.append(entry_time)
+            if include_user:
+                current_row.append(user or "")
+
+            for field_id, field_value in values.items():
+                field_value = field_value or ""
+                # Check for filter. Entries are prefiltered in SQL by
+                # ``entry_filters``, and each filter is checked here to
+                # complete those that can't be fully expressed in SQL.
+                filter_type, filter_args = self.field_filter(field_id)
+                if filter_args:
+                    # Convert dates before checking filter.
+                    if field_id in date_field_ids:
+                        dte = parse_typed_values(fields.DATE,
+                                                 field_value)["date_value"]
+                        if dte is None and any(filter_args):
+                            # Missing dates aren't within any range.
+                            valid_row = False
                             break
-                    if (user_found == False):
-                        current_row.append("")
-
-            field_value = field_entry.value or ""
-            # Check for filter.
-            field_id = field_entry.field_id
-            filter_type = self.posted_data("field_%s_filter" % field_id)
-            filter_args = None
-            if filter_type:
-                if filter_type == FILTER_CHOICE_BETWEEN:
-                    f, t = "field_%s_from" % field_id, "field_%s_to" % field_id
-                    filter_args = [self.posted_data(f), self.posted_data(t)]
+                        if dte is not None:
+                            if timezone.is_aware(dte):
+                                dte = timezone.localtime(dte)
+                            dte = dte.date()
+                        filter_args.append(dte)
+                    else:
+                        filter_args.append(field_value)
+                    filter_func = FILTER_FUNCS[filter_type]
+                    if not filter_func(*filter_args):
+                        valid_row = False
+                        break
+                # Create download URL for file fields.
+                if field_value and field_id in file_field_ids:
+                    url = reverse("admin:form_entry_file",
+                                  args=(entry_id, field_id))
+                    file_name = split(field_value)[1]
+                    if self.request is not None:
+                        url = self.request.build_absolute_uri(url)
+                    field_value = url
+                    if not csv:
+                        parts = (field_value, file_name)
+                        field_value = mark_safe("<a href=\"%s\">%s</a>" % parts)
+                # Only use values for fields that were selected.
+                try:
+                    field_value = field_value.encode("utf-8")
+                    current_row[field_indexes[field_id]] = field_value
+                except KeyError:
+                    pass
+            if valid_row:
+                if not csv:
+                    current_row.insert(0, entry_id)
+                yield tuple(current_row)
+
+    def field_filter(self, field_id):
+        """
+        Return the filter type and list of arguments selected for the
+        given field ID, with an empty list if it isn't filtered.
+        """
+        filter_type = self.posted_data("field_%s_filter" % field_id)
+        filter_args = []
+        if filter_type:
+            if filter_type == FILTER_CHOICE_BETWEEN:
+                f, t = "field_%s_from" % field_id, "field_%s_to" % field_id
+                filter_args = [self.posted_data(f), self.posted_data(t)]
+            else:
+                field_name = "field_%s_contains" % field_id
+                filter_args = self.posted_data(field_name)
+                if filter_args:
+                    filter_args = [filter_args]
+        return filter_type, filter_args or []
+
+    def entry_filters(self):
+        """
+        Compile the selected field filters into a list of ``(sql,
+        params)`` conditions for ``extra(where=...)`` on entries, each
+        matching entries with a field entry for the field that may pass
+        the filter, or without one, as entries missing a field always
+        pass its filter. Both are correlated ``EXISTS`` subqueries, so
+        that entries missing a field are found with a ``NOT EXISTS``
+        anti-join. These are prefilters matching at least every entry
+        passing a filter, so that ``rows`` only fetches candidate entries
+        and checks the filters exactly:
+
+        - Text that contains or equals an ASCII search term with a case
+          insensitive ``LIKE`` or comparison, which ignore the case of
+          ASCII letters on every backend.
+        - Choices equal to any of the selected choices, or for multiple
+          choice fields, entries with a selection of any or each of the
+          selected choices, looked up by their indexed hashes, including
+          entries without any selections for the field, which may not
+          have been backfilled yet. These are skipped for fields with
+          choices containing commas, which ``rows`` splits differently.
+        - Dates between two dates with the indexed ``date_value`` column,
+          including entries not yet backfilled with a typed value.
+
+        Other filters, those excluding matches and text searches for
+        non-ASCII terms, are only checked by ``rows``.
+        """
+        field_entries = self.fieldentry_model.objects.order_by()
+        entry_model = self.formentry_model
+        filters = []
+        for field in self.form_fields:
+            filter_type, filter_args = self.field_filter(field.id)
+            if not filter_args:
+                continue
+            query = None
+            matching = []
+            missing = [exists(field_entries.filter(field_id=field.id),
+                              "entry", entry_model)]
+            if filter_type == FILTER_CHOICE_BETWEEN:
+                date_from, date_to = filter_args
+                if field.is_a(*fields.DATES) and (date_from or date_to):
+                    between = []
+                    if date_from:
+                        between.append(Q(date_value__gte=day_start(date_from)))
+                    if date_to:
+                        date_to += timedelta(days=1)
+                        between.append(Q(date_value__lt=day_start(date_to)))
+                    query = reduce(and_, between) | Q(date_value__isnull=True)
+            elif filter_type in (FILTER_CHOICE_CONTAINS,
+                                 FILTER_CHOICE_EQUALS):
+                term = filter_args[0]
+                try:
+                    term.encode("ascii")
+                except UnicodeError:
+                    continue
+                if filter_type == FILTER_CHOICE_CONTAINS:
+                    query = Q(value__icontains=term)
                 else:
-                    field_name = "field_%s_contains" % field_id
-                    filter_args = self.posted_data(field_name)
-                    if filter_args:
-                        filter_args = [filter_args]
-            if filter_args:
-                # Convert dates before checking filter.
-                if field_id in date_field_ids:
-                    y, m, d = field_value.split(" ")[0].split("-")
-                    dte = date(int(y), int(m), int(d))
-                    filter_args.append(dte)
+                    query = Q(value__iexact=term)
+            elif filter_type in (FILTER_CHOICE_CONTAINS_ANY,
+                                 FILTER_CHOICE_CONTAINS_ALL):
+                choices = filter_args[0]
+                if [c for c, label in field.get_choices() if "," in c]:
+                    continue
+                selections = self.selection_model.objects
+                if not field.is_a(*fields.MULTIPLE):
+                    query = Q(value__in=choices)
                 else:
-                    filter_args.append(field_value)
-                filter_func = FILTER_FUNCS[filter_type]
-                if not filter_func(*filter_args):
-                    valid_row = False
-            # Create download URL for file fields.
-            if field_entry.value and field_id in file_field_ids:
-                url = reverse("admin:form_file", args=(field_entry.id,))
-                field_value = self.request.build_absolute_uri(url)
-                if not csv:
-                    parts = (field_value, split(field_entry.value)[1])
-                    field_value = mark_safe("<a href=\"%s\">%s</a>" % parts)
-            # Only use values for fields that were selected.
-            try:
-                field_value = field_value.encode("utf-8")
-                current_row[field_indexes[field_id]] = field_value
-            except KeyError:
-                pass
-        # Output the final row.
-        if valid_row and current_row is not None:
-            if not csv:
-                current_row.insert(0, current_entry)
-            yield current_row
+                    if filter_type == FILTER_CHOICE_CONTAINS_ANY:
+                        choices = [choices]
+                    else:
+                        choices = [[choice] for choice in choices]
+                    matching.extend([exists(selections.selected(field.id,
+                        selected), "entry", entry_model)
+                        for selected in choices])
+                    missing.append(exists(selections.filter(
+                        field_id=field.id), "entry", entry_model))
+            if query is not None:
+                matching.append(exists(field_entries.filter(query,
+                    field_id=field.id), "entry", entry_model))
+            if not matching:
+                continue
+            sql = "((%s) OR %s)" % (" AND ".join([m[0] for m in matching]),
+                " OR ".join(["NOT %s" % m[0] for m in missing]))
+            params = sum([m[1] for m in matching + missing], ())
+            filters.append((sql, params))
+        return filters
+
+    def entry_users(self, entry_ids):
+        """
+        Return a dict mapping the given entry IDs to the users who
+        submitted them, read with a single query of their user entries.
+        """
+        user_entries = self.userentry_model.objects.filter(
+            entry__in=entry_ids).select_related("user")
+        return dict([(e.entry_id, e.user) for e in user_entries])
+
+    def entry_values(self, batch_size=1000, field_ids=None, users=False):
+        """
+        Yield the ID, entry time, a dict mapping field IDs to values and
+        the user who submitted it, if any and ``users`` is true, for each
+        entry of the form, newest first, filtered by entry time if
+        specified and by ``entry_filters``. Entries are read in batches
+        of ``batch_size`` with keyset pagination on their IDs, so memory
+        use doesn't grow with the number of entries. Entries with stored
+        ``data`` are read as one row each, and the field entries of any
+        other entries, and their users, are loaded with one query per
+        batch of entries.
+        When ``field_ids`` is given for some of the form's fields, only
+        their field entries are read for every entry, rather than the
+        stored ``data`` holding all of the entry's values.
+        """
+        if field_ids is not None:
+            all_field_ids = set([field.id for field in self.form_fields])
+            if all_field_ids.issubset(field_ids):
+                field_ids = None
+        entries = self.formentry_model.objects.filter(form=self.form)
+        if self.posted_data("field_0_filter") == FILTER_CHOICE_BETWEEN:
+            time_from = self.posted_data("field_0_from")
+            time_to = self.posted_data("field_0_to")
+            if time_from and time_to:
+                entries = entries.filter(
+                    entry_time__range=(time_from, time_to))
+        for sql, params in self.entry_filters():
+            entries = entries.extra(where=[sql], params=params)
+        if field_ids is None:
+            entries = entries.values_list("id", "entry_time", "data")
+        else:
+            entries = entries.values_list("id", "entry_time")
+        entries = entries.order_by("-id")
+        last_id = None
+        while True:
+            batch = entries
+            if last_id is not None:
+                batch = batch.filter(id__lt=last_id)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            if field_ids is not None:
+                batch = [entry + (None,) for entry in batch]
+            entry_users = {}
+            if users:
+                entry_users = self.entry_users([entry[0] for entry in batch])
+            for entry_id, entry_time, values in self.load_entry_values(
+                    batch, field_ids):
+                yield entry_id, entry_time, values, entry_users.get(entry_id)
+            last_id = batch[-1][0]
+
+    def load_entry_values(self, entries, field_ids=None):
+        """
+        Return the ID, entry time and values of each of the given
+        (id, entry_time, data) entries, reading the field entries of
+        entries without ``data`` for the given field IDs, or all fields.
+        """
+        missing = dict([(entry_id, {}) for entry_id, entry_time, data
+                        in entries if data is None])
+        if missing and field_ids != []:
+            field_entries = self.fieldentry_model.objects.filter(
+                entry__in=list(missing))
+            if field_ids is not None:
+                field_entries = field_entries.filter(field_id__in=field_ids)
+            field_entries = field_entries.values_list("entry_id", "field_id",
+                                                      "value")
+            for entry_id, field_id, value in field_entries:
+                missing[entry_id][field_id] = value
+        rows = []
+        for entry_id, entry_time, data in entries:
+            if data is None:
+                values = missing[entry_id]
+            else:
+                values = load_entry_data(data)
+            rows.append((entry_id, entry_time, values))
+        return rows
@@ -0,0 +1,194 @@
+import logging
+from collections import namedtuple
+from time import time
+
+from django.db import IntegrityError
+from django.utils.dateparse import parse_datetime
+
+from forms_builder.forms import fields
+from forms_builder.forms.caching import flush_version_bumps
+from forms_builder.forms.models import (Form, Field, FormEntry, FieldEntry,
+                                        UserEntry, Selection, Tally, Rollup,
+                                        STATUS_PUBLIC, dump_entry_data,
+                                        value_hash)
+from forms_builder.forms.permissions import (has_user_submitted,
+                                             mark_user_submitted)
+from forms_builder.forms.rollups import apply_rollups, count_entries
+from forms_builder.forms.settings import ENTRY_DATA, USE_ROLLUPS, USE_TALLIES
+from forms_builder.forms.signals import form_valid
+from forms_builder.forms.spool import get_spool
+from forms_builder.forms.tallies import apply_tallies, count_values
+from forms_builder.forms.utils import atomic, now, split_selections
+
+
+logger = logging.getLogger("forms_builder")
+
+
+DrainResult = namedtuple("DrainResult", ("drained", "duplicates",
+                                         "max_latency"))
+
+
+def enqueue_submission(form_for_form, user):
+    """
+    Queue the values of a valid ``FormForForm`` to be written by the
+    ``drain_form_submissions`` management command. Raises
+    ``IntegrityError`` if the user has already submitted a non-public
+    form, so that one vote per user is enforced before queueing as well
+    as when the vote is written.
+    """
+    form = form_for_form.form
+    user_id = None
+    if user is not None and user.is_authenticated():
+        user_id = user.pk
+        userentry_model = form_for_form.user_entry_model
+        if has_user_submitted(form, user, userentry_model):
+            raise IntegrityError("User has already submitted this form")
+    value_field = form_for_form.field_entry_model._meta.get_field("value")
+    values = [(field.id, value_field.get_prep_value(value))
+              for field, value in form_for_form.field_values()]
+    record = {"form": form.id, "user": user_id,
+              "entry_time": now().isoformat(), "values": values}
+    name = get_spool("submissions").put(record)
+    if user_id is not None:
+        mark_user_submitted(form, user)
+    return name
+
+
+class SubmissionDrainer(object):
+    """
+    Writes submissions queued by ``enqueue_submission`` in batches.
+
+    Each batch is written in a single transaction, with one INSERT per
+    entry and user entry, and one bulk INSERT each for all of the
+    batch's field entries and selections. With ``USE_TALLIES`` and
+    ``USE_ROLLUPS`` enabled, each form's tallies and rollups are updated
+    once per batch. A user entry that violates the one vote per user
+    constraint discards its submission. The ``form_valid`` signal is
+    sent for each entry once the batch is committed, with the drainer
+    as the sender and ``form`` set to ``None``, since the original
+    ``FormForForm`` isn't available.
+    """
+
+    form_model = Form
+    field_model = Field
+    formentry_model = FormEntry
+    fieldentry_model = FieldEntry
+    userentry_model = UserEntry
+    selection_model = Selection
+    tally_model = Tally
+    rollup_model = Rollup
+
+    def __init__(self, spool=None):
+        if spool is None:
+            spool = get_spool("submissions")
+        self.spool = spool
+
+    def stats(self):
+        """
+        Return the queue depth and the seconds the oldest queued
+        submission has been waiting.
+        """
+        return {"depth": self.spool.depth(),
+                "oldest_age": self.spool.oldest_age()}
+
+    def drain(self, batch_size=100):
+        """
+        Write up to ``batch_size`` queued submissions.
+        """
+        claimed = self.spool.claim(batch_size)
+        if not claimed:
+            return DrainResult(0, 0, 0)
+        form_ids = set([record["form"] for name, record in claimed])
+        forms = self.form_model.objects.in_bulk(form_ids)
+        form_fields = dict([(field.id, field) for field in
+                            self.field_model.objects.filter(form__in=form_ids)])
+        entries = []
+        duplicates = 0
+        with atomic():
+            field_entries = []
+            selections = []
+            tallies = {}
+            rollups = {}
+            for name, record in claimed:
+                form = forms.get(record["form"])
+                if form is None:
+                    # The form has since been deleted.
+                    continue
+                try:
+                    entry = self.write_entry(form, record)
+                except IntegrityError:
+                    duplicates += 1
+                    continue
+                for field_id, value in record["values"]:
+                    field = form_fields.get(field_id)
+                    field_type = getattr(field, "field_type", None)
+                    field_entry = self.fieldentry_model(entry=entry,
+                                                        field_id=field_id,
+                                                        value=value)
+                    field_entry.set_typed_values(field_type)
+                    field_entries.append(field_entry)
+                    if field_type in fields.MULTIPLE and value:
+                        choices = [c for c, l in field.get_choices()]
+                        for option in split_selections(value, choices):
+                            selections.append(self.selection_model(
+                                entry=entry, field_id=field_id, value=option,
+                                value_hash=value_hash(option)))
+                if USE_TALLIES:
+                    rows = [(field_id, value, 1)
+                            for field_id, value in record["values"]]
+                    count_values(form_fields.values(), rows,
+                                 tallies.setdefault(form.id, {}))
+                if USE_ROLLUPS:
+                    count_entries([entry.entry_time],
+                                  rollups.setdefault(form.id, {}))
+                entries.append(entry)
+            self.fieldentry_model.objects.bulk_create(field_entries)
+            self.selection_model.objects.bulk_create(selections)
+            for form_id, deltas in tallies.items():
+                apply_tallies(forms[form_id], deltas, self.tally_model)
+            for form_id, deltas in rollups.items():
+                apply_rollups(forms[form_id], deltas, self.rollup_model)
+        flush_version_bumps()
+        committed = time()
+        for name, record in claimed:
+            self.spool.ack(name)
+        max_latency = max([committed - self.spool.available_at(name)
+                           for name, record in claimed])
+        for entry in entries:
+            self.send_form_valid(entry)
+        return DrainResult(len(entries), duplicates, max_latency)
+
+    def send_form_valid(self, entry):
+        """
+        Send ``form_valid`` for a written entry, logging rather than
+        raising the errors of its receivers, so that a receiver written
+        for requests can't stop the queue from being drained.
+        """
+        responses = form_valid.send_robust(sender=self, form=None,
+                                           entry=entry)
+        for receiver, response in responses:
+            if isinstance(response, Exception):
+                logger.error("Signal receiver %r failed for entry %s: %r" %
+                             (receiver, entry.id, response))
+
+    def write_entry(self, form, record):
+        """
+        Create the entry for a queued submission, and its user entry for
+        non-public forms, in a savepoint so that a duplicate vote only
+        rolls back its own submission. The ``atomic`` block nested in
+        the batch's transaction is a savepoint, which is why Django 1.6
+        is required.
+        """
+        with atomic():
+            entry = self.formentry_model(form=form,
+                entry_time=parse_datetime(record["entry_time"]))
+            if ENTRY_DATA:
+                entry.data = dump_entry_data(dict(record["values"]))
+            entry.save()
+            if form.can_submit_status != STATUS_PUBLIC:
+                user_entry = self.userentry_model(form=form,
+                                                  user_id=record["user"])
+                if form.anonymous_vote is False:
+                    user_entry.entry = entry
+                user_entry.save()
+        return entry
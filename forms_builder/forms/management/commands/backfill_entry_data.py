@@ -0,0 +1,54 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from forms_builder.forms.models import FormEntry, FieldEntry, dump_entry_data
+from forms_builder.forms.utils import atomic, bulk_update
+
+
+class Command(NoArgsCommand):
+    """
+    Store the values of entries written without ``ENTRY_DATA`` enabled
+    as JSON on each entry, or with ``--refresh``, rewrite it for every
+    entry, such as after field entries were changed without
+    ``FormEntry.refresh_data``. Entries are read in primary key order
+    and updated in batches, each in its own transaction, so the command
+    can be interrupted and run again.
+    """
+
+    help = "Store the field values of existing entries as JSON."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=500, help="Entries updated per batch."),
+        make_option("--refresh", action="store_true", dest="refresh",
+                    default=False, help="Also rewrite the stored data of "
+                    "entries that already have it."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options["verbosity"])
+        entries = FormEntry.objects.order_by("id")
+        if not options["refresh"]:
+            entries = entries.filter(data__isnull=True)
+        last_id = 0
+        total = 0
+        while True:
+            entry_ids = list(entries.filter(id__gt=last_id).values_list(
+                "id", flat=True)[:options["batch_size"]])
+            if not entry_ids:
+                break
+            values = dict([(entry_id, {}) for entry_id in entry_ids])
+            field_entries = FieldEntry.objects.filter(
+                entry__in=entry_ids).values_list("entry_id", "field_id",
+                                                 "value")
+            for entry_id, field_id, value in field_entries:
+                values[entry_id][field_id] = value
+            rows = dict([(entry_id, {"data": dump_entry_data(data)})
+                         for entry_id, data in values.items()])
+            with atomic():
+                total += bulk_update(FormEntry, rows, ["data"])
+            last_id = entry_ids[-1]
+            if verbosity > 1:
+                self.stdout.write("Updated %s entries" % total)
+        if verbosity:
+            self.stdout.write("Stored data for %s entries" % total)
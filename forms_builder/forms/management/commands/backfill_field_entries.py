@@ -0,0 +1,55 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from forms_builder.forms import fields
+from forms_builder.forms.models import (Field, FieldEntry, TYPED_VALUE_FIELDS,
+                                        parse_typed_values)
+from forms_builder.forms.utils import atomic, bulk_update
+
+
+class Command(NoArgsCommand):
+    """
+    Fill the typed value columns of field entries written before they
+    were added. Rows are read in primary key order and updated in
+    batches, each in its own transaction, so the command can be
+    interrupted and run again.
+    """
+
+    help = "Fill the typed value columns of existing field entries."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=1000, help="Field entries updated per batch."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options["verbosity"])
+        field_types = dict(Field.objects.filter(
+            field_type__in=(fields.NUMBER, fields.CHECKBOX) + fields.DATES
+        ).values_list("id", "field_type"))
+        if not field_types:
+            return
+        field_entries = FieldEntry.objects.filter(
+            field_id__in=list(field_types), value__isnull=False,
+            number_value__isnull=True, date_value__isnull=True,
+            bool_value__isnull=True).order_by("id")
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(field_entries.filter(id__gt=last_id).values_list(
+                "id", "field_id", "value")[:options["batch_size"]])
+            if not batch:
+                break
+            rows = {}
+            for field_entry_id, field_id, value in batch:
+                typed = parse_typed_values(field_types[field_id], value)
+                if any([v is not None for v in typed.values()]):
+                    rows[field_entry_id] = typed
+            with atomic():
+                total += bulk_update(FieldEntry, rows, TYPED_VALUE_FIELDS)
+            last_id = batch[-1][0]
+            if verbosity > 1:
+                self.stdout.write("Updated %s field entries" % total)
+        if verbosity:
+            self.stdout.write("Filled typed values for %s field entries" %
+                              total)
@@ -0,0 +1,61 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from forms_builder.forms import fields
+from forms_builder.forms.models import Field, FieldEntry, Selection, value_hash
+from forms_builder.forms.utils import atomic, split_selections
+
+
+class Command(NoArgsCommand):
+    """
+    Store a selection row for each option chosen in field entries for
+    multiple choice fields written before selections were stored. Field
+    entries are read in primary key order and written in batches, each
+    in its own transaction, skipping any that already have selections,
+    so the command can be interrupted and run again.
+    """
+
+    help = "Store the selected options of existing multiple choice entries."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=1000, help="Field entries read per batch."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options["verbosity"])
+        choices = {}
+        for field in Field.objects.filter(field_type__in=fields.MULTIPLE):
+            choices[field.id] = [c for c, l in field.get_choices()]
+        if not choices:
+            return
+        field_entries = FieldEntry.objects.filter(field_id__in=list(choices),
+            value__isnull=False).exclude(value="").order_by("id")
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(field_entries.filter(id__gt=last_id).values_list(
+                "id", "entry_id", "field_id", "value")[:options["batch_size"]])
+            if not batch:
+                break
+            entry_ids = set([entry_id for _, entry_id, _, _ in batch])
+            existing = set(Selection.objects.filter(entry__in=entry_ids,
+                field_id__in=list(choices)).values_list("entry_id",
+                                                        "field_id"))
+            selections = []
+            for _, entry_id, field_id, value in batch:
+                if (entry_id, field_id) in existing:
+                    continue
+                for option in split_selections(value, choices[field_id]):
+                    selections.append(Selection(entry_id=entry_id,
+                                                field_id=field_id,
+                                                value=option,
+                                                value_hash=value_hash(option)))
+            with atomic():
+                Selection.objects.bulk_create(selections)
+            total += len(selections)
+            last_id = batch[-1][0]
+            if verbosity > 1:
+                self.stdout.write("Stored %s selections" % total)
+        if verbosity:
+            self.stdout.write("Stored %s selections" % total)
@@ -0,0 +1,67 @@
+from cStringIO import StringIO
+from csv import writer
+from optparse import make_option
+from resource import RUSAGE_SELF, getrusage
+from time import time
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.test.client import RequestFactory
+
+from forms_builder.forms.forms import EntriesForm
+from forms_builder.forms.models import Form
+from forms_builder.forms.settings import CSV_DELIMITER, CSV_ENCODING
+from forms_builder.forms.utils import csv_stream
+
+
+class Command(NoArgsCommand):
+    """
+    Time the CSV export of form entries and report the peak memory used,
+    for generated rows or for the entries of an existing form. Run it
+    once with and once without ``--buffered`` to compare the streaming
+    export with building the whole file in memory.
+    """
+
+    help = "Time the CSV export of form entries."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--entries", type="int", dest="entries", default=1000000,
+                    help="Number of rows to generate."),
+        make_option("--fields", type="int", dest="fields", default=10,
+                    help="Number of columns to generate."),
+        make_option("--form", dest="form", default=None,
+                    help="Slug of a form to export instead of generating "
+                    "rows."),
+        make_option("--buffered", action="store_true", dest="buffered",
+                    default=False, help="Build the whole file in memory "
+                    "before encoding it."),
+    )
+
+    def handle_noargs(self, **options):
+        if options["form"]:
+            try:
+                form = Form.objects.get(slug=options["form"])
+            except Form.DoesNotExist:
+                raise CommandError("No form with the slug %s" % options["form"])
+            request = RequestFactory().get("/")
+            entries_form = EntriesForm(form, request)
+            columns = entries_form.columns()
+            rows = entries_form.rows(csv=True)
+        else:
+            columns = ["Field %s" % i for i in range(options["fields"])]
+            value = u"Caf\xe9 %s".encode("utf-8")
+            rows = ([value % i] * options["fields"]
+                    for i in xrange(options["entries"]))
+        start = time()
+        size = 0
+        if options["buffered"]:
+            queue = StringIO()
+            csv = writer(queue, delimiter=CSV_DELIMITER)
+            csv.writerow(columns)
+            for row in rows:
+                csv.writerow(row)
+            size = len(queue.getvalue().decode("utf-8").encode(CSV_ENCODING))
+        else:
+            for chunk in csv_stream(columns, rows, CSV_DELIMITER, CSV_ENCODING):
+                size += len(chunk)
+        self.stdout.write("%s export: %.3fs, %s bytes, peak memory %s KB" % (
+            "Buffered" if options["buffered"] else "Streaming",
+            time() - start, size, getrusage(RUSAGE_SELF).ru_maxrss))
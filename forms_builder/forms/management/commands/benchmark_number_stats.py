@@ -0,0 +1,59 @@
+from array import array
+from optparse import make_option
+from random import gauss
+from time import time
+
+from django.core.management.base import NoArgsCommand
+
+from forms_builder.forms.stats import (NUMPY_INSTALLED, number_values,
+                                       numpy_stats, python_stats)
+
+
+class Command(NoArgsCommand):
+    """
+    Time the statistics computed for number fields on the responses
+    page, for random values held in memory, or for the values of an
+    existing field including loading them from the database.
+    """
+
+    help = "Time the statistics computed for number fields."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--values", type="int", dest="values", default=1000000,
+                    help="Number of random values to generate."),
+        make_option("--chunk-size", type="int", dest="chunk_size",
+                    default=10000, help="Values per chunk."),
+        make_option("--bins", type="int", dest="bins", default=10,
+                    help="Number of histogram bins."),
+        make_option("--field", type="int", dest="field", default=None,
+                    help="ID of a number field to load values for instead "
+                    "of generating them."),
+    )
+
+    def handle_noargs(self, **options):
+        chunk_size = options["chunk_size"]
+        start = time()
+        if options["field"]:
+            chunks = list(number_values(options["field"], chunk_size))
+            self.report("Load field %s" % options["field"], start)
+        else:
+            chunks = []
+            for i in range(0, options["values"], chunk_size):
+                size = min(chunk_size, options["values"] - i)
+                chunks.append(array("d", [gauss(100, 15)
+                                          for _ in range(size)]))
+            self.report("Generate values", start)
+        implementations = [("Pure Python", python_stats)]
+        if NUMPY_INSTALLED:
+            implementations.append(("NumPy", numpy_stats))
+        else:
+            self.stdout.write("NumPy isn't installed, skipping it")
+        for name, stats in implementations:
+            start = time()
+            result = stats(chunks, options["bins"])
+            self.report(name, start)
+            if result is not None and int(options["verbosity"]) > 1:
+                self.stdout.write("  count=%s mean=%.3f stddev=%.3f" % (
+                    result.count, result.mean, result.stddev))
+
+    def report(self, name, start):
+        self.stdout.write("%s: %.3fs" % (name, time() - start))
@@ -0,0 +1,46 @@
+from optparse import make_option
+from time import sleep
+
+from django.core.management.base import NoArgsCommand
+
+from forms_builder.forms.ingest import SubmissionDrainer
+
+
+class Command(NoArgsCommand):
+    """
+    Write submissions queued while ``FORMS_BUILDER_INGEST`` is enabled.
+    """
+
+    help = "Write queued form submissions to the database."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=100, help="Submissions written per transaction."),
+        make_option("--loop", action="store_true", dest="loop",
+                    default=False, help="Keep draining until interrupted."),
+        make_option("--interval", type="float", dest="interval", default=1,
+                    help="Seconds to wait when the queue is empty."),
+        make_option("--recover", action="store_true", dest="recover",
+                    default=False, help="Requeue submissions left claimed by "
+                    "a drainer that stopped. Only use when no other drainer "
+                    "is running."),
+    )
+
+    def handle_noargs(self, **options):
+        drainer = SubmissionDrainer()
+        verbosity = int(options["verbosity"])
+        if options["recover"]:
+            recovered = drainer.spool.recover()
+            if verbosity:
+                self.stdout.write("Recovered %s submissions" % recovered)
+        while True:
+            result = drainer.drain(options["batch_size"])
+            if verbosity and result.drained + result.duplicates:
+                stats = drainer.stats()
+                self.stdout.write("Wrote %s submissions, discarded %s "
+                    "duplicates, max latency %.3fs, queue depth %s" % (
+                    result.drained, result.duplicates, result.max_latency,
+                    stats["depth"]))
+            if result.drained + result.duplicates < options["batch_size"]:
+                if not options["loop"]:
+                    break
+                sleep(options["interval"])
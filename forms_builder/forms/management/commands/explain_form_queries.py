@@ -0,0 +1,96 @@
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import connections, router
+from django.db.models import Count
+
+from forms_builder.forms.models import Form, FormEntry, FieldEntry
+from forms_builder.forms.utils import now
+
+
+# The EXPLAIN syntax for each database vendor.
+EXPLAIN = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+    "mysql": "EXPLAIN ",
+    "oracle": "EXPLAIN PLAN FOR ",
+}
+
+
+class Command(NoArgsCommand):
+    """
+    Print the database's query plans for the queries that read forms
+    and entries, to check that they use the indexes added for them
+    rather than sequential scans. Run it before and after migrating to
+    compare plans.
+    """
+
+    help = "Print the query plans for the form and entry queries."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--form", dest="form", default=None,
+                    help="Slug of the form to use, defaults to the form "
+                    "with the most entries."),
+        make_option("--analyze", action="store_true", dest="analyze",
+                    default=False, help="Use EXPLAIN ANALYZE on PostgreSQL, "
+                    "which runs each query and reports actual timings."),
+    )
+
+    def handle_noargs(self, **options):
+        form = self.get_form(options["form"])
+        db = router.db_for_read(FieldEntry)
+        connection = connections[db]
+        try:
+            explain = EXPLAIN[connection.vendor]
+        except KeyError:
+            raise CommandError("EXPLAIN isn't supported for %s" %
+                               connection.vendor)
+        if options["analyze"] and connection.vendor == "postgresql":
+            explain = "EXPLAIN ANALYZE "
+        for name, queryset in self.get_queries(form):
+            sql, params = queryset.query.sql_with_params()
+            cursor = connection.cursor()
+            cursor.execute(explain + sql, params)
+            self.stdout.write("%s\n%s\n" % (name, "-" * len(name)))
+            for row in cursor.fetchall():
+                self.stdout.write(" ".join([unicode(c) for c in row]))
+            self.stdout.write("")
+
+    def get_form(self, slug):
+        if slug:
+            try:
+                return Form.objects.get(slug=slug)
+            except Form.DoesNotExist:
+                raise CommandError("No form with the slug %s" % slug)
+        forms = Form.objects.annotate(num_entries=Count("entries"))
+        try:
+            return forms.order_by("-num_entries")[0]
+        except IndexError:
+            raise CommandError("There are no forms to explain queries for")
+
+    def get_queries(self, form):
+        """
+        Return the named querysets to explain, matching the access paths
+        of the published forms filter, the entries export and the
+        responses view.
+        """
+        field_id = form.fields.values_list("id", flat=True)[:1]
+        field_id = field_id[0] if field_id else 0
+        entry_id = form.entries.values_list("id", flat=True)[:1]
+        entry_id = entry_id[0] if entry_id else 0
+        time_to = now()
+        time_from = time_to - timedelta(days=30)
+        field_entries = FieldEntry.objects.filter(entry__form=form)
+        return (
+            ("Published forms", Form.objects.published()),
+            ("Export field entries", field_entries.order_by("-entry__id")),
+            ("Export field entries by entry time", field_entries.filter(
+                entry__entry_time__range=(time_from, time_to)
+            ).order_by("-entry__id")),
+            ("Entries by entry time", FormEntry.objects.filter(form=form,
+                entry_time__range=(time_from, time_to))),
+            ("Field entries for a field", field_entries.filter(
+                field_id=field_id)),
+            ("Field entry for an entry and field", FieldEntry.objects.filter(
+                entry_id=entry_id, field_id=field_id)),
+        )
@@ -0,0 +1,46 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from forms_builder.forms.forms import EntriesForm
+from forms_builder.forms.models import Form
+from forms_builder.forms.settings import CSV_DELIMITER, CSV_ENCODING
+from forms_builder.forms.utils import csv_stream
+
+
+class Command(NoArgsCommand):
+    """
+    Export all entries of a form as CSV, streamed in batches so that
+    memory use doesn't grow with the number of entries.
+    """
+
+    help = "Export the entries of a form as CSV."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--form", dest="form", default=None,
+                    help="Slug of the form to export."),
+        make_option("--output", dest="output", default=None,
+                    help="File to write to, defaults to standard output."),
+    )
+
+    def handle_noargs(self, **options):
+        if not options["form"]:
+            raise CommandError("The --form option is required")
+        try:
+            form = Form.objects.get(slug=options["form"])
+        except Form.DoesNotExist:
+            raise CommandError("No form with the slug %s" % options["form"])
+        entries_form = EntriesForm(form, None)
+        content = csv_stream(entries_form.columns(),
+                             entries_form.rows(csv=True),
+                             CSV_DELIMITER, CSV_ENCODING)
+        if options["output"]:
+            output = open(options["output"], "wb")
+        else:
+            output = sys.stdout
+        try:
+            for chunk in content:
+                output.write(chunk)
+        finally:
+            if options["output"]:
+                output.close()
@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from forms_builder.forms.models import Form
+from forms_builder.forms.rollups import rebuild_rollups
+
+
+class Command(NoArgsCommand):
+    """
+    Recompute the submission rollups kept when ``USE_ROLLUPS`` is
+    enabled, such as after enabling it for forms with existing entries.
+    """
+
+    help = ("Recompute the hourly and daily submission rollups of forms "
+            "from their entries.")
+    option_list = NoArgsCommand.option_list + (
+        make_option("--form", dest="form", default=None,
+                    help="Slug of the form to rebuild, defaults to all forms."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options["verbosity"])
+        forms = Form.objects.all()
+        if options["form"]:
+            forms = forms.filter(slug=options["form"])
+            if not forms:
+                raise CommandError("No form with the slug %s" % options["form"])
+        for form in forms:
+            count = rebuild_rollups(form)
+            if verbosity:
+                self.stdout.write("Rebuilt %s rollups for %s" % (count, form))
@@ -0,0 +1,31 @@
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from forms_builder.forms.models import Form
+from forms_builder.forms.tallies import rebuild_tallies
+
+
+class Command(NoArgsCommand):
+    """
+    Recompute the tallies of choice fields kept when ``USE_TALLIES`` is
+    enabled, such as after enabling it for forms with existing entries.
+    """
+
+    help = "Recompute the per-choice tallies of forms from their entries."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--form", dest="form", default=None,
+                    help="Slug of the form to rebuild, defaults to all forms."),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options["verbosity"])
+        forms = Form.objects.all()
+        if options["form"]:
+            forms = forms.filter(slug=options["form"])
+            if not forms:
+                raise CommandError("No form with the slug %s" % options["form"])
+        for form in forms:
+            count = rebuild_tallies(form)
+            if verbosity:
+                self.stdout.write("Rebuilt %s tallies for %s" % (count, form))
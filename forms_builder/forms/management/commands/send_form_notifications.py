@@ -0,0 +1,45 @@
+from optparse import make_option
+from time import sleep
+
+from django.core.management.base import NoArgsCommand
+
+from forms_builder.forms.notifications import NotificationSender
+
+
+class Command(NoArgsCommand):
+    """
+    Send notification emails queued while
+    ``FORMS_BUILDER_EMAIL_NOTIFICATIONS`` is enabled.
+    """
+
+    help = "Send queued form notification emails."
+    option_list = NoArgsCommand.option_list + (
+        make_option("--batch-size", type="int", dest="batch_size",
+                    default=100, help="Emails sent per connection."),
+        make_option("--loop", action="store_true", dest="loop",
+                    default=False, help="Keep sending until interrupted."),
+        make_option("--interval", type="float", dest="interval", default=5,
+                    help="Seconds to wait when the queue is empty."),
+        make_option("--recover", action="store_true", dest="recover",
+                    default=False, help="Requeue emails left claimed by a "
+                    "sender that stopped. Only use when no other sender is "
+                    "running."),
+    )
+
+    def handle_noargs(self, **options):
+        sender = NotificationSender()
+        verbosity = int(options["verbosity"])
+        if options["recover"]:
+            recovered = sender.spool.recover()
+            if verbosity:
+                self.stdout.write("Recovered %s emails" % recovered)
+        while True:
+            result = sender.send(options["batch_size"])
+            total = result.sent + result.retried + result.failed
+            if verbosity and total:
+                self.stdout.write("Sent %s emails, %s to retry, %s failed" %
+                                  result)
+            if total < options["batch_size"]:
+                if not options["loop"]:
+                    break
+                sleep(options["interval"])
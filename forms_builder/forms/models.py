@@ -1,13 +1,24 @@
+from datetime import datetime
+from hashlib import md5
+from math import ceil, isinf, isnan
+import json
+
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.conf import settings as django_settings
 from django.contrib.sites.models import Site
 from django.db import models
-from django.db.models import Q
+from django.db.models import Count, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.translation import ugettext, ugettext_lazy as _
 from django.contrib.auth.models import Group
 
 from forms_builder.forms import fields
 from forms_builder.forms import settings
+from forms_builder.forms.caching import (bump_form_version, cache_key,
+                                         get_form_version)
 from forms_builder.forms.utils import now, slugify, unique_slug
 
 STATUS_DRAFT = 1
@@ -39,6 +50,55 @@ class FormManager(models.Manager):
             filters.append(Q(sites=Site.objects.get_current()))
         return self.filter(*filters)
 
+    def get_published(self, slug, for_user=None):
+        """
+        Return the published form with the given slug, raising
+        ``DoesNotExist`` if there isn't one. For non-staff users the
+        lookup is cached per site until the form's next publish or
+        expiry date, or until any form is saved.
+        """
+        if for_user is not None and for_user.is_staff:
+            return self.get(slug=slug)
+        key = cache_key("published", get_form_version(self.model),
+                        django_settings.SITE_ID, slug)
+        cached = cache.get(key)
+        if cached is None:
+            filters = [~Q(can_view_status=STATUS_DRAFT)]
+            if settings.USE_SITES:
+                filters.append(Q(sites=Site.objects.get_current()))
+            try:
+                form = self.filter(*filters).get(slug=slug)
+            except self.model.DoesNotExist:
+                form = None
+            cached = (form,)
+            cache.set(key, cached, self.published_timeout(form))
+        form = cached[0]
+        if form is None or not self.is_published(form):
+            raise self.model.DoesNotExist
+        return form
+
+    def is_published(self, form):
+        """
+        Check the publish and expiry dates of the given form.
+        """
+        current = now()
+        return ((form.publish_date is None or form.publish_date <= current)
+                and (form.expiry_date is None or form.expiry_date >= current))
+
+    def published_timeout(self, form):
+        """
+        Seconds until the given form's next publish or expiry boundary,
+        capped by the ``PUBLISHED_CACHE_TIMEOUT`` setting.
+        """
+        timeout = settings.PUBLISHED_CACHE_TIMEOUT
+        if form is not None:
+            current = now()
+            for boundary in (form.publish_date, form.expiry_date):
+                if boundary is not None and boundary > current:
+                    seconds = (boundary - current).total_seconds()
+                    timeout = min(timeout, int(ceil(seconds)))
+        return timeout
+
 
 ######################################################################
 #                                                                    #
@@ -64,14 +124,14 @@ class AbstractForm(models.Model):
     response = models.TextField(_("Response"), blank=True)
 
     can_view_status = models.IntegerField(_("Can view status"), choices=STATUS_CHOICES,
-                                          default=STATUS_PUBLIC)
+                                          default=STATUS_PUBLIC, db_index=True)
     can_view_groups = models.ManyToManyField(Group, related_name="View Groups", blank=True)
     publish_date = models.DateTimeField(_("Published from"),
                                         help_text=_("Won't be shown until this time"),
-                                        blank=True, null=True)
+                                        blank=True, null=True, db_index=True)
     expiry_date = models.DateTimeField(_("Expires on"),
                                        help_text=_("Won't be shown after this time"),
-                                       blank=True, null=True)
+                                       blank=True, null=True, db_index=True)
 
     can_submit_status = models.IntegerField(_("Can submit status"), choices=STATUS_CHOICES,
                                             default=STATUS_PUBLIC)
@@ -152,13 +212,12 @@ class AbstractForm(models.Model):
         return False
 
     def is_user_permitted(self, user, permission):
-        if permission == 'view':
-            return self.can_user(user, self.can_view_status, self.can_view_groups.all())
-        if permission == 'submit':
-            return self.can_user(user, self.can_submit_status, self.can_submit_groups.all())
-        if permission == 'responses':
-            return self.can_user(user, self.can_view_responses_status, self.can_view_responses_groups.all())
-        raise TypeError('Type must be view,submit or responses')
+        """
+        Check the given permission (view, submit or responses) for the
+        user, via ``forms_builder.forms.permissions.FormPermissions``.
+        """
+        from forms_builder.forms.permissions import FormPermissions
+        return FormPermissions(self, user).can(permission)
 
     admin_links.allow_tags = True
     admin_links.short_description = ""
@@ -242,33 +301,251 @@ class AbstractField(models.Model):
         return self.field_type in args
 
 
+# The typed value columns of field entries.
+TYPED_VALUE_FIELDS = ("number_value", "date_value", "bool_value")
+
+
+def dump_entry_data(values):
+    """
+    Serialize a dict mapping field IDs to stored values as JSON, for
+    the ``data`` column of a form entry.
+    """
+    return json.dumps(dict([(str(k), v) for k, v in values.items()]))
+
+
+def load_entry_data(data):
+    """
+    Load the ``data`` column of a form entry into a dict mapping field
+    IDs to stored values.
+    """
+    return dict([(int(k), v) for k, v in json.loads(data).items()])
+
+
 class AbstractFormEntry(models.Model):
     """
     An entry submitted via a user-built form.
+
+    When ``ENTRY_DATA`` is enabled, the values of all of the entry's
+    fields are also stored as JSON in ``data``, so that the entry can be
+    read as one row rather than one row per field. ``data`` is kept in
+    sync by ``FormForForm.save``, and field entries written any other
+    way must be followed by a call to ``refresh_data``.
     """
 
     entry_time = models.DateTimeField(_("Date/time"))
+    data = models.TextField(null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = _("Form entry")
         verbose_name_plural = _("Form entries")
         abstract = True
 
+    def get_values(self):
+        """
+        Return a dict mapping field IDs to the entry's stored values,
+        from ``data`` when it has been written, otherwise from the
+        entry's field entries.
+        """
+        if self.data is not None:
+            return load_entry_data(self.data)
+        return dict(self.fields.values_list("field_id", "value"))
+
+    def refresh_data(self):
+        """
+        Store the values of the entry's field entries as JSON in
+        ``data``, if it's been written, after they've been changed.
+        """
+        if self.data is not None:
+            values = self.fields.values_list("field_id", "value")
+            self.data = dump_entry_data(dict(values))
+            self.save(update_fields=["data"])
+
+
+def parse_typed_values(field_type, value):
+    """
+    Return a dict of the typed value columns of a field entry for the
+    given field type and stored string value. Number fields fill
+    ``number_value``, date fields ``date_value`` and check boxes
+    ``bool_value``, and values that can't be parsed, or numbers that
+    aren't finite, are left as None.
+    """
+    typed = dict.fromkeys(TYPED_VALUE_FIELDS)
+    if not value:
+        return typed
+    if field_type == fields.NUMBER:
+        try:
+            number_value = float(value)
+        except ValueError:
+            number_value = None
+        # Backends differ in storing infinity and NaN, if at all.
+        if number_value is not None and not (isinf(number_value) or
+                                             isnan(number_value)):
+            typed["number_value"] = number_value
+    elif field_type in fields.DATES:
+        try:
+            date_value = parse_datetime(value)
+            if date_value is None:
+                parsed = parse_date(value)
+                if parsed is not None:
+                    date_value = datetime(parsed.year, parsed.month,
+                                          parsed.day)
+        except ValueError:
+            date_value = None
+        if date_value is not None and django_settings.USE_TZ:
+            if timezone.is_naive(date_value):
+                date_value = timezone.make_aware(date_value,
+                                                 timezone.get_default_timezone())
+        elif date_value is not None and timezone.is_aware(date_value):
+            date_value = timezone.make_naive(date_value,
+                                             timezone.get_default_timezone())
+        typed["date_value"] = date_value
+    elif field_type == fields.CHECKBOX:
+        typed["bool_value"] = value == "True"
+    return typed
+
 
 class AbstractFieldEntry(models.Model):
     """
     A single field value for a form entry submitted via a user-built form.
+
+    Values are always stored as strings in ``value``. Entries for number,
+    date and check box fields also store the value in a typed column, so
+    that they can be filtered, sorted and aggregated in SQL.
     """
 
-    field_id = models.IntegerField()
+    field_id = models.IntegerField(db_index=True)
     value = models.CharField(max_length=settings.FIELD_MAX_LENGTH,
                              null=True)
+    number_value = models.FloatField(null=True, blank=True, editable=False)
+    date_value = models.DateTimeField(null=True, blank=True, editable=False)
+    bool_value = models.NullBooleanField(editable=False)
 
     class Meta:
         verbose_name = _("Form field entry")
         verbose_name_plural = _("Form field entries")
         abstract = True
 
+    def set_typed_values(self, field_type):
+        """
+        Fill the typed value columns from ``value`` for the given field
+        type.
+        """
+        for name, typed in parse_typed_values(field_type, self.value).items():
+            setattr(self, name, typed)
+
+
+def value_hash(value):
+    """
+    Return the MD5 hex digest of a choice, indexed in place of choices,
+    which can be longer than MySQL allows in an index.
+    """
+    return md5(value.encode("utf-8")).hexdigest()
+
+
+class SelectionManager(models.Manager):
+    """
+    Queries over the options selected for multiple choice fields.
+    """
+
+    def counts(self, field_ids):
+        """
+        Return a dict mapping each of the given field IDs to a dict
+        mapping each option selected for it to the number of entries that
+        selected it, with a single GROUP BY.
+        """
+        counts = dict([(field_id, {}) for field_id in field_ids])
+        rows = self.filter(field_id__in=list(field_ids)).values("field_id",
+            "value").annotate(count=Count("id")).order_by()
+        for row in rows:
+            counts[row["field_id"]][row["value"]] = row["count"]
+        return counts
+
+    def selected(self, field_id, values):
+        """
+        Return the selections of any of the given options for the given
+        field, looked up by their indexed hashes.
+        """
+        return self.filter(field_id=field_id,
+                           value_hash__in=map(value_hash, values))
+
+
+class AbstractSelection(models.Model):
+    """
+    An option selected for a multiple choice field in an entry. Field
+    entries store the options joined with ``", "``, and each one is also
+    stored as its own row, so that entries can be counted and filtered
+    by option in SQL, and so that options containing ``", "`` aren't
+    ambiguous.
+    """
+
+    field_id = models.IntegerField()
+    value = models.CharField(max_length=settings.CHOICES_MAX_LENGTH)
+    value_hash = models.CharField(max_length=32, editable=False)
+
+    objects = SelectionManager()
+
+    class Meta:
+        verbose_name = _("Selection")
+        verbose_name_plural = _("Selections")
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.value_hash = value_hash(self.value)
+        super(AbstractSelection, self).save(*args, **kwargs)
+
+
+# The value of the tally holding a field's total number of answers.
+TALLY_TOTAL = ""
+
+
+class AbstractTally(models.Model):
+    """
+    The number of entries that chose a choice of a field, kept up to
+    date as entries are written and deleted when ``USE_TALLIES`` is
+    enabled. The tally with the ``TALLY_TOTAL`` value holds the number
+    of entries that answered the field.
+    """
+
+    field_id = models.IntegerField()
+    value = models.CharField(max_length=settings.CHOICES_MAX_LENGTH,
+                             blank=True)
+    value_hash = models.CharField(max_length=32, editable=False)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Tally")
+        verbose_name_plural = _("Tallies")
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.value_hash = value_hash(self.value)
+        super(AbstractTally, self).save(*args, **kwargs)
+
+
+ROLLUP_HOUR = "hour"
+ROLLUP_DAY = "day"
+ROLLUP_PERIODS = (
+    (ROLLUP_HOUR, _("Hour")),
+    (ROLLUP_DAY, _("Day")),
+)
+
+
+class AbstractRollup(models.Model):
+    """
+    The number of entries submitted to a form in an hour or a day, kept
+    up to date as entries are written and deleted when ``USE_ROLLUPS``
+    is enabled.
+    """
+
+    period = models.CharField(max_length=10, choices=ROLLUP_PERIODS)
+    start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Rollup")
+        verbose_name_plural = _("Rollups")
+        abstract = True
+
 
 class AbstractUserEntry(models.Model):
     user = models.ForeignKey(django_settings.AUTH_USER_MODEL)
@@ -288,10 +565,38 @@ class AbstractUserEntry(models.Model):
 class FormEntry(AbstractFormEntry):
     form = models.ForeignKey("Form", related_name="entries")
 
+    class Meta(AbstractFormEntry.Meta):
+        index_together = [["form", "entry_time"]]
+
 
 class FieldEntry(AbstractFieldEntry):
     entry = models.ForeignKey("FormEntry", related_name="fields")
 
+    class Meta(AbstractFieldEntry.Meta):
+        index_together = [["entry", "field_id"], ["field_id", "number_value"],
+                          ["field_id", "date_value"]]
+
+
+class Selection(AbstractSelection):
+    entry = models.ForeignKey("FormEntry", related_name="selections")
+
+    class Meta(AbstractSelection.Meta):
+        index_together = [["field_id", "value_hash"]]
+
+
+class Tally(AbstractTally):
+    form = models.ForeignKey("Form", related_name="tallies")
+
+    class Meta(AbstractTally.Meta):
+        unique_together = [["field_id", "value_hash"]]
+
+
+class Rollup(AbstractRollup):
+    form = models.ForeignKey("Form", related_name="rollups")
+
+    class Meta(AbstractRollup.Meta):
+        unique_together = [["form", "period", "start"]]
+
 
 class Form(AbstractForm):
     pass
@@ -325,3 +630,55 @@ class Field(AbstractField):
         fields_after = self.form.fields.filter(order__gte=self.order)
         fields_after.update(order=models.F("order") - 1)
         super(Field, self).delete(*args, **kwargs)
+
+
+def form_changed(sender, instance, **kwargs):
+    """
+    Issue a new version for a form whenever it or one of its fields is
+    saved or deleted, invalidating any data cached for the form.
+    """
+    if isinstance(instance, AbstractForm):
+        bump_form_version(instance)
+        bump_form_version(instance, "voters")
+        bump_form_version(instance.__class__)
+    elif isinstance(instance, AbstractField):
+        form_model = instance._meta.get_field("form").rel.to
+        bump_form_version(form_model(id=instance.form_id))
+
+
+def form_relations_changed(sender, instance, action, model, **kwargs):
+    """
+    Sites and groups are assigned after a form is saved, so also issue
+    new versions when those relations change, from either side.
+    """
+    if action.startswith("post_"):
+        if isinstance(instance, AbstractForm):
+            form_changed(sender, instance)
+        elif issubclass(model, AbstractForm):
+            bump_form_version(model)
+
+
+def user_entry_deleted(sender, instance, **kwargs):
+    """
+    A deleted vote allows the user to submit the form again, so issue a
+    new voters version for the form.
+    """
+    if isinstance(instance, AbstractUserEntry):
+        form_model = instance._meta.get_field("form").rel.to
+        bump_form_version(form_model(id=instance.form_id), "voters")
+
+def entry_changed(sender, instance, **kwargs):
+    """
+    Issue a new entries version for a form whenever one of its entries
+    is saved or deleted, invalidating its cached responses.
+    """
+    if isinstance(instance, AbstractFormEntry):
+        form_model = instance._meta.get_field("form").rel.to
+        bump_form_version(form_model(id=instance.form_id), "entries")
+
+post_save.connect(form_changed)
+post_delete.connect(form_changed)
+post_save.connect(entry_changed)
+post_delete.connect(entry_changed)
+post_delete.connect(user_entry_deleted)
+m2m_changed.connect(form_relations_changed)
@@ -0,0 +1,144 @@
+from collections import namedtuple
+
+from django.conf import settings as django_settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import RequestContext
+from django.template.loader import render_to_string
+
+from forms_builder.forms.settings import (EMAIL_MAX_ATTEMPTS,
+                                          EMAIL_RETRY_DELAY,
+                                          SEND_FROM_SUBMITTER)
+from forms_builder.forms.spool import get_spool
+from forms_builder.forms.utils import split_choices
+
+
+SendResult = namedtuple("SendResult", ("sent", "retried", "failed"))
+
+
+def queue_notifications(form_for_form, request):
+    """
+    Render the notification emails for a valid submission once, and
+    queue them to be sent by the ``send_form_notifications`` management
+    command. An email is sent to the submitter when the form's
+    ``send_email`` option is checked and the form has an email field,
+    and a copy to each of the form's ``email_copies`` recipients.
+    Returns the number of emails queued.
+    """
+    form = form_for_form.form
+    email_to = form_for_form.email_to()
+    email_from = form.email_from or django_settings.DEFAULT_FROM_EMAIL
+    email_copies = split_choices(form.email_copies)
+    messages = []
+    if form.send_email and email_to:
+        messages.append({"from": email_from, "to": [email_to],
+                         "headers": {}})
+    if email_copies:
+        headers = {}
+        copies_from = email_from
+        if email_to:
+            headers["Reply-To"] = email_to
+            if SEND_FROM_SUBMITTER:
+                copies_from = email_to
+        messages.append({"from": copies_from, "to": email_copies,
+                         "headers": headers})
+    if not messages:
+        return 0
+    fields = []
+    for field in form_for_form.form_fields:
+        value = form_for_form.cleaned_data[field.slug]
+        if isinstance(value, list):
+            value = ", ".join([v.strip() for v in value])
+        elif hasattr(value, "name"):
+            value = value.name
+        fields.append((field.label, value))
+    context = RequestContext(request, {"message": form.email_message,
+                                       "fields": fields, "form": form})
+    subject = form.email_subject or form.title
+    body = render_to_string("email_extras/form_response.txt", context)
+    html = render_to_string("email_extras/form_response.html", context)
+    spool = get_spool("notifications")
+    for message in messages:
+        message.update({"subject": subject, "body": body, "html": html,
+                        "attempts": 0})
+        spool.put(message)
+    return len(messages)
+
+
+class NotificationSender(object):
+    """
+    Sends queued notification emails in batches over a single email
+    backend connection. A failed email is retried with exponential
+    backoff, and moved aside into the spool's ``failed`` directory once
+    ``EMAIL_MAX_ATTEMPTS`` is reached.
+    """
+
+    def __init__(self, spool=None):
+        if spool is None:
+            spool = get_spool("notifications")
+        self.spool = spool
+
+    def send(self, batch_size=100):
+        """
+        Send up to ``batch_size`` queued emails.
+        """
+        claimed = self.spool.claim(batch_size)
+        sent = retried = failed = 0
+        if not claimed:
+            return SendResult(sent, retried, failed)
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception:
+            connection = None
+        try:
+            for name, record in claimed:
+                if connection is not None:
+                    try:
+                        self.message(record, connection).send()
+                    except Exception:
+                        # The connection may have been dropped.
+                        connection = self.reconnect(connection)
+                    else:
+                        self.spool.ack(name)
+                        sent += 1
+                        continue
+                if self.attempt_failed(name, record):
+                    retried += 1
+                else:
+                    failed += 1
+        finally:
+            if connection is not None:
+                connection.close()
+        return SendResult(sent, retried, failed)
+
+    def attempt_failed(self, name, record):
+        """
+        Requeue a record that failed to send with exponential backoff,
+        returning ``False`` if it has run out of attempts instead.
+        """
+        record["attempts"] += 1
+        if record["attempts"] >= EMAIL_MAX_ATTEMPTS:
+            self.spool.fail(name)
+            return False
+        delay = EMAIL_RETRY_DELAY * 2 ** (record["attempts"] - 1)
+        self.spool.retry(name, record, delay)
+        return True
+
+    def message(self, record, connection):
+        """
+        Build the email for a queued record.
+        """
+        message = EmailMultiAlternatives(record["subject"], record["body"],
+                                         record["from"], record["to"],
+                                         headers=record["headers"],
+                                         connection=connection)
+        message.attach_alternative(record["html"], "text/html")
+        return message
+
+    def reconnect(self, connection):
+        try:
+            connection.close()
+            connection.open()
+        except Exception:
+            return None
+        return connection
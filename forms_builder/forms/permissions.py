@@ -0,0 +1,134 @@
+from django.core.cache import cache
+from django.db import connections, router
+
+from forms_builder.forms.caching import cache_key, get_form_version
+from forms_builder.forms.models import (UserEntry, STATUS_PUBLIC,
+                                        STATUS_PRIVATE, STATUS_GROUPS)
+from forms_builder.forms.settings import VOTER_CACHE_TIMEOUT
+
+
+# The status and groups fields of a form for each permission.
+PERMISSION_FIELDS = {
+    "view": ("can_view_status", "can_view_groups"),
+    "submit": ("can_submit_status", "can_submit_groups"),
+    "responses": ("can_view_responses_status", "can_view_responses_groups"),
+}
+
+
+def user_group_ids(user):
+    """
+    Return the set of group IDs for the given user, memoized on the
+    user instance so that it's loaded at most once per request.
+    """
+    try:
+        return user._forms_builder_group_ids
+    except AttributeError:
+        group_ids = frozenset()
+        if user.is_authenticated():
+            group_ids = frozenset(user.groups.values_list("id", flat=True))
+        user._forms_builder_group_ids = group_ids
+        return group_ids
+
+
+def form_group_ids(form):
+    """
+    Return a dict mapping each groups field of the given form to the
+    set of group IDs it contains, memoized on the form instance. Only
+    fields whose status is set to groups are loaded, all of them with a
+    single query across their through tables.
+    """
+    try:
+        return form._forms_builder_group_ids
+    except AttributeError:
+        pass
+    group_ids = {}
+    selects = []
+    for status_name, groups_name in PERMISSION_FIELDS.values():
+        if getattr(form, status_name) == STATUS_GROUPS:
+            group_ids[groups_name] = set()
+            selects.append(groups_name)
+    if selects:
+        db = router.db_for_read(form.__class__, instance=form)
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        sql = []
+        for i, groups_name in enumerate(selects):
+            field = form._meta.get_field(groups_name)
+            sql.append("SELECT %s, %s FROM %s WHERE %s = %%s" % (i,
+                qn(field.m2m_reverse_name()),
+                qn(field.rel.through._meta.db_table),
+                qn(field.m2m_column_name())))
+        cursor = connection.cursor()
+        cursor.execute(" UNION ALL ".join(sql), [form.pk] * len(selects))
+        for i, group_id in cursor.fetchall():
+            group_ids[selects[i]].add(group_id)
+    form._forms_builder_group_ids = group_ids
+    return group_ids
+
+
+def voter_key(form, user):
+    return cache_key("voter", form.pk, get_form_version(form, "voters"),
+                     user.pk)
+
+
+def has_user_submitted(form, user, userentry_model=UserEntry):
+    """
+    Check whether the user has already submitted the given non-public
+    form. Known voters are cached per form, so repeat votes are turned
+    away without touching the database, while other users are checked
+    with an indexed lookup on the unique (user, form) pair, which also
+    remains the final guarantee when the vote is written.
+    """
+    if form.can_submit_status == STATUS_PUBLIC or not user.is_authenticated():
+        return False
+    key = voter_key(form, user)
+    if cache.get(key):
+        return True
+    submitted = userentry_model.objects.filter(form=form, user=user).exists()
+    if submitted:
+        cache.set(key, True, VOTER_CACHE_TIMEOUT)
+    return submitted
+
+
+def mark_user_submitted(form, user):
+    """
+    Remember that the user has submitted the given non-public form.
+    """
+    if form.can_submit_status != STATUS_PUBLIC and user.is_authenticated():
+        cache.set(voter_key(form, user), True, VOTER_CACHE_TIMEOUT)
+
+
+class FormPermissions(object):
+    """
+    Answers the view, submit and responses permissions of a form for a
+    user, from snapshots of the form's groups and the user's groups
+    that are each loaded at most once.
+    """
+
+    def __init__(self, form, user):
+        self.form = form
+        self.user = user
+
+    def can(self, permission):
+        try:
+            status_name, groups_name = PERMISSION_FIELDS[permission]
+        except KeyError:
+            raise TypeError("Type must be view, submit or responses")
+        status = getattr(self.form, status_name)
+        if self.user.is_staff or status == STATUS_PUBLIC:
+            return True
+        if status == STATUS_PRIVATE:
+            return self.user.is_authenticated()
+        if status == STATUS_GROUPS:
+            groups = form_group_ids(self.form)[groups_name]
+            return not groups.isdisjoint(user_group_ids(self.user))
+        return False
+
+    def can_view(self):
+        return self.can("view")
+
+    def can_submit(self):
+        return self.can("submit")
+
+    def can_view_responses(self):
+        return self.can("responses")
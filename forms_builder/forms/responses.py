@@ -0,0 +1,256 @@
+from collections import namedtuple
+from hashlib import md5
+from time import time
+
+from django.core.cache import cache
+from django.db import connections, router
+from django.db.models import Count, Min
+
+from forms_builder.forms import fields
+from forms_builder.forms.caching import cache_key, get_form_version
+from forms_builder.forms.models import (FieldEntry, Selection, Tally,
+                                        TALLY_TOTAL)
+from forms_builder.forms import settings
+from forms_builder.forms.rollups import rollup_series
+from forms_builder.forms.stats import field_number_stats
+
+
+ChoiceCount = namedtuple("ChoiceCount", ("choice", "count", "percent"))
+AnswerCount = namedtuple("AnswerCount", ("answer", "count"))
+
+# A computed responses summary, with the versions of the form and its
+# entries it was computed from, and when.
+CachedResponses = namedtuple("CachedResponses", ("versions", "computed_at",
+                                                 "responses"))
+
+
+class FieldResponses(object):
+    """
+    The aggregated responses to a single field. ``kind`` is one of
+    ``"choice"``, with a ``ChoiceCount`` for each of the field's choices
+    in ``choices`` and the number of entries answering in ``answered``,
+    ``"file"``, with the number of uploaded files in ``files``,
+    ``"number"``, with the ``NumberStats`` of its values in ``stats``, or
+    ``"text"``, with an ``AnswerCount`` for each of the most frequent
+    answers in ``answers``, and the cursor of the next page of answers
+    in ``next_cursor``.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        if field.is_a(*(fields.CHOICES + fields.MULTIPLE)):
+            self.kind = "choice"
+        elif field.is_a(fields.FILE):
+            self.kind = "file"
+        elif field.is_a(fields.NUMBER):
+            self.kind = "number"
+        else:
+            self.kind = "text"
+        self.choices = []
+        self.answers = []
+        self.files = 0
+        self.total = 0
+        self.answered = 0
+        self.next_cursor = None
+        self.stats = None
+
+    def choice_values(self):
+        if self.field.is_a(fields.CHECKBOX):
+            return ["True", "False"]
+        return [choice for choice, label in self.field.get_choices()]
+
+    def set_counts(self, counts):
+        """
+        Store the count and percentage of each choice from a dict mapping
+        choices to counts. Values that aren't one of the field's choices
+        are ignored.
+        """
+        choices = self.choice_values()
+        self.total = sum([counts.get(choice, 0) for choice in choices])
+        self.choices = []
+        for choice in choices:
+            count = counts.get(choice, 0)
+            percent = 0
+            if self.total:
+                percent = round(count * 100.0 / self.total, 2)
+            self.choices.append(ChoiceCount(choice, count, percent))
+
+
+class FormResponses(object):
+    """
+    The aggregated responses to each field of a form, iterated in the
+    order of the form's fields, and with ``USE_ROLLUPS`` enabled, the
+    daily submissions of the last 30 days from ``rollup_series`` in
+    ``submissions``.
+    """
+
+    def __init__(self, form, form_fields):
+        self.form = form
+        self.fields = [FieldResponses(field) for field in form_fields]
+        self.submissions = []
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def by_kind(self, kind):
+        return dict([(r.field.id, r) for r in self.fields if r.kind == kind])
+
+
+def aggregate_responses(form, fieldentry_model=FieldEntry, tally_model=Tally,
+                        selection_model=Selection):
+    """
+    Aggregate the responses to each field of the given form, returning
+    a ``FormResponses``. Field IDs are unique to a form, so field entries
+    are read by their indexed ``field_id`` without joining entries, with
+    one query for each group of field types: a GROUP BY of values for
+    choice fields, a GROUP BY of the options stored as selections for
+    multiple choice fields, a GROUP BY of fields for the number of file
+    uploads and multiple choice answers, the values of each number
+    field read in chunks for ``field_number_stats``, and for each other
+    field, its ``RESPONSES_TOP_ANSWERS`` most frequent answers from
+    ``top_answers``. With ``USE_TALLIES`` enabled, choice fields are
+    read from the form's tallies instead, one row per choice regardless
+    of the number of entries.
+    """
+    responses = FormResponses(form, form.fields.all())
+    field_entries = fieldentry_model.objects.order_by()
+
+    choice_fields = responses.by_kind("choice")
+    multiple_fields = {}
+    if choice_fields and settings.USE_TALLIES:
+        counts = dict([(field_id, {}) for field_id in choice_fields])
+        tallies = tally_model.objects.filter(form=form).values_list(
+            "field_id", "value", "count")
+        for field_id, choice, count in tallies:
+            if field_id in counts:
+                counts[field_id][choice] = count
+        for field_id, field_responses in choice_fields.items():
+            field_responses.answered = counts[field_id].pop(TALLY_TOTAL, 0)
+            field_responses.set_counts(counts[field_id])
+    elif choice_fields:
+        multiple_fields = dict([(field_id, field_responses)
+            for field_id, field_responses in choice_fields.items()
+            if field_responses.field.is_a(*fields.MULTIPLE)])
+        counts = dict([(field_id, {}) for field_id in choice_fields
+                       if field_id not in multiple_fields])
+        if counts:
+            grouped = field_entries.filter(field_id__in=list(counts),
+                value__isnull=False).exclude(value="").values("field_id",
+                "value").annotate(count=Count("id"))
+            for row in grouped:
+                choice_fields[row["field_id"]].answered += row["count"]
+                counts[row["field_id"]][row["value"]] = row["count"]
+        if multiple_fields:
+            counts.update(selection_model.objects.counts(multiple_fields))
+        for field_id, field_responses in choice_fields.items():
+            field_responses.set_counts(counts[field_id])
+
+    file_fields = responses.by_kind("file")
+    if file_fields or multiple_fields:
+        answered_fields = dict(file_fields)
+        answered_fields.update(multiple_fields)
+        grouped = field_entries.filter(field_id__in=list(answered_fields),
+            value__isnull=False).exclude(value="").values(
+            "field_id").annotate(count=Count("id"))
+        for row in grouped:
+            if row["field_id"] in file_fields:
+                file_fields[row["field_id"]].files = row["count"]
+                file_fields[row["field_id"]].total = row["count"]
+            else:
+                multiple_fields[row["field_id"]].answered = row["count"]
+
+    for field_id, field_responses in responses.by_kind("number").items():
+        field_responses.stats = field_number_stats(field_id,
+            settings.RESPONSES_HISTOGRAM_BINS, fieldentry_model)
+        if field_responses.stats is not None:
+            field_responses.total = field_responses.stats.count
+
+    for field_id, field_responses in responses.by_kind("text").items():
+        answers, next_cursor = top_answers(field_id,
+            settings.RESPONSES_TOP_ANSWERS, fieldentry_model=fieldentry_model)
+        field_responses.answers = answers
+        field_responses.next_cursor = next_cursor
+        field_responses.total = len(answers)
+
+    if settings.USE_ROLLUPS:
+        responses.submissions = rollup_series(form)
+
+    return responses
+
+
+def top_answers(field_id, limit, cursor=None, fieldentry_model=FieldEntry):
+    """
+    Return a page of the answers to a field, normalized by ignoring case
+    and surrounding whitespace, as a list of ``AnswerCount`` ordered by
+    frequency then answer, along with the cursor of the next page, or
+    ``None`` for the last page. Answers are counted with a GROUP BY of
+    the normalized value, and each is shown as the smallest of its
+    stored forms, as compared by the database.
+    """
+    try:
+        offset = max(int(cursor or 0), 0)
+    except ValueError:
+        offset = 0
+    connection = connections[router.db_for_read(fieldentry_model)]
+    column = fieldentry_model._meta.get_field("value").column
+    normalized = "LOWER(TRIM(%s))" % connection.ops.quote_name(column)
+    answers = fieldentry_model.objects.filter(field_id=field_id).extra(
+        select={"normalized": normalized}, where=["%s <> ''" % normalized]
+    ).values("normalized").annotate(count=Count("id"),
+        answer=Min("value")).order_by("-count", "normalized")
+    rows = list(answers[offset:offset + limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = str(offset + limit)
+        rows = rows[:limit]
+    answers = [AnswerCount(r["answer"].strip(), r["count"]) for r in rows]
+    return answers, next_cursor
+
+
+def responses_versions(form):
+    """
+    Return the current versions of the form and of its entries.
+    """
+    return (get_form_version(form), get_form_version(form, "entries"))
+
+
+def responses_etag(versions):
+    return md5(":".join(versions)).hexdigest()
+
+
+def get_cached_responses(form):
+    """
+    Return the ``CachedResponses`` for the form if it was computed from
+    the current versions of the form and its entries, or from older
+    entries within the ``RESPONSES_STALE_TIMEOUT`` window, otherwise
+    ``None``.
+    """
+    if not settings.RESPONSES_CACHE_TIMEOUT:
+        return None
+    cached = cache.get(cache_key("responses", form.pk))
+    if cached is None:
+        return None
+    versions = responses_versions(form)
+    if cached.versions == versions:
+        return cached
+    age = time() - cached.computed_at
+    if cached.versions[0] == versions[0] and (
+            age < settings.RESPONSES_STALE_TIMEOUT):
+        return cached
+    return None
+
+
+def compute_responses(form, versions):
+    """
+    Aggregate the form's responses, caching them against the given
+    versions, which should be read before aggregating so that entries
+    written meanwhile invalidate the result.
+    """
+    cached = CachedResponses(versions, time(), aggregate_responses(form))
+    if settings.RESPONSES_CACHE_TIMEOUT:
+        cache.set(cache_key("responses", form.pk), cached,
+                  settings.RESPONSES_CACHE_TIMEOUT)
+    return cached
@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from forms_builder.forms.models import (FormEntry, Rollup, ROLLUP_DAY,
+                                        ROLLUP_HOUR)
+from forms_builder.forms.utils import apply_deltas, atomic, now
+
+
+PERIOD_LENGTHS = {
+    ROLLUP_HOUR: timedelta(hours=1),
+    ROLLUP_DAY: timedelta(days=1),
+}
+
+
+def bucket_start(entry_time, period):
+    """
+    Return the start of the hour or day holding the given time. With
+    time zone support enabled, hours are truncated in UTC and days in
+    the default time zone.
+    """
+    if timezone.is_naive(entry_time):
+        start = entry_time.replace(minute=0, second=0, microsecond=0)
+        if period == ROLLUP_DAY:
+            start = start.replace(hour=0)
+        return start
+    if period == ROLLUP_HOUR:
+        start = entry_time.astimezone(timezone.utc)
+        return start.replace(minute=0, second=0, microsecond=0)
+    tz = timezone.get_default_timezone()
+    start = timezone.make_naive(entry_time, tz)
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timezone.make_aware(start, tz)
+
+
+def count_entries(entry_times, deltas=None, sign=1):
+    """
+    Add the hour and day buckets of the given entry times to a dict
+    mapping ``(period, start)`` pairs to deltas, returning it.
+    """
+    if deltas is None:
+        deltas = {}
+    for entry_time in entry_times:
+        for period in PERIOD_LENGTHS:
+            key = (period, bucket_start(entry_time, period))
+            deltas[key] = deltas.get(key, 0) + sign
+    return deltas
+
+
+def apply_rollups(form, deltas, rollup_model=Rollup):
+    """
+    Apply a dict mapping ``(period, start)`` pairs to deltas to the
+    form's rollups.
+    """
+    apply_deltas(rollup_model.objects.filter(form=form), ("period", "start"),
+                 deltas, {"form": form})
+
+
+def remove_entry_rollups(form, entry_ids, formentry_model=FormEntry,
+                         rollup_model=Rollup):
+    """
+    Subtract the given entries from the form's rollups, before the
+    entries are deleted.
+    """
+    entry_times = formentry_model.objects.filter(id__in=entry_ids,
+        form=form).values_list("entry_time", flat=True)
+    apply_rollups(form, count_entries(entry_times, sign=-1), rollup_model)
+
+
+def rebuild_rollups(form, formentry_model=FormEntry, rollup_model=Rollup,
+                    chunk_size=10000):
+    """
+    Recompute the form's rollups from the entry times of its entries,
+    read in primary key chunks.
+    """
+    entries = formentry_model.objects.filter(form=form).order_by("id")
+    deltas = {}
+    last_id = 0
+    while True:
+        rows = list(entries.filter(id__gt=last_id).values_list(
+            "id", "entry_time")[:chunk_size])
+        if not rows:
+            break
+        count_entries([entry_time for _, entry_time in rows], deltas)
+        last_id = rows[-1][0]
+    with atomic():
+        rollup_model.objects.filter(form=form).delete()
+        rollup_model.objects.bulk_create([rollup_model(form=form,
+            period=period, start=start, count=count)
+            for (period, start), count in deltas.items()])
+    return len(deltas)
+
+
+def rollup_series(form, period=ROLLUP_DAY, buckets=30, end=None,
+                  rollup_model=Rollup):
+    """
+    Return a chart-ready list of ``(start, count)`` pairs for the given
+    number of hour or day buckets up to and including the one holding
+    ``end``, which defaults to now, with empty buckets filled with zero.
+    """
+    if end is None:
+        end = now()
+    length = PERIOD_LENGTHS[period]
+    last = bucket_start(end, period)
+    first = bucket_start(last - length * (buckets - 1), period)
+    counts = dict(rollup_model.objects.filter(form=form, period=period,
+        start__gte=first, start__lte=last).values_list("start", "count"))
+    series = []
+    start = first
+    while start <= last:
+        series.append((start, counts.get(start, 0)))
+        step = start + length
+        if period == ROLLUP_DAY:
+            # Days are 23 or 25 hours long across daylight saving changes.
+            step += timedelta(hours=1)
+        start = bucket_start(step, period)
+    return series
@@ -0,0 +1,67 @@
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from forms_builder.forms.caching import cache_key, get_form_version
+from forms_builder.forms.settings import SCHEMA_CACHE_TIMEOUT
+
+
+class FieldSpec(namedtuple("FieldSpec", ("id", "slug", "label", "field_type",
+        "required", "help_text", "default", "default_is_template",
+        "placeholder_text", "choices"))):
+    """
+    Immutable snapshot of a visible ``Field``, holding everything
+    ``FormForForm`` needs to build its form field.
+    """
+
+    __slots__ = ()
+
+    def get_choices(self):
+        return self.choices
+
+    def is_a(self, *args):
+        """
+        Helper that returns True if the field's type is given in any arg.
+        """
+        return self.field_type in args
+
+
+FormSchema = namedtuple("FormSchema", ("version", "fields"))
+
+
+def compile_schema(form, version=None):
+    """
+    Build the ``FormSchema`` for the given form from its visible fields.
+    """
+    specs = []
+    for field in form.fields.visible():
+        default = field.default or ""
+        specs.append(FieldSpec(
+            id=field.id,
+            slug=field.slug,
+            label=field.label,
+            field_type=field.field_type,
+            required=field.required,
+            help_text=field.help_text,
+            default=default,
+            default_is_template="{" in default,
+            placeholder_text=field.placeholder_text,
+            choices=tuple(field.get_choices()),
+        ))
+    return FormSchema(version=version, fields=tuple(specs))
+
+
+def get_form_schema(form):
+    """
+    Return the ``FormSchema`` for the given form, compiling and caching
+    it under the form's current version when it isn't already cached.
+    """
+    if form.pk is None:
+        return compile_schema(form)
+    version = get_form_version(form)
+    key = cache_key("schema", form.pk, version)
+    schema = cache.get(key)
+    if schema is None:
+        schema = compile_schema(form, version)
+        cache.set(key, schema, SCHEMA_CACHE_TIMEOUT)
+    return schema
@@ -33,6 +33,10 @@ CHOICES_UNQUOTE = getattr(settings, "FORMS_BUILDER_CHOICES_UNQUOTE", "`")
 # Char to use as a field delimiter when exporting form responses as CSV.
 CSV_DELIMITER = getattr(settings, "FORMS_BUILDER_CSV_DELIMITER", ",")
 
+# Encoding of exported CSV files, which should write a byte order mark for
+# Excel to detect it, such as "utf-16" or "utf-8-sig".
+CSV_ENCODING = getattr(settings, "FORMS_BUILDER_CSV_ENCODING", "utf-16")
+
 # Boolean controlling whether emails to staff recipients are sent from the form submitter.
 SEND_FROM_SUBMITTER = getattr(settings, "FORMS_BUILDER_SEND_FROM_SUBMITTER", True)
 
@@ -41,3 +45,98 @@ HELPTEXT_MAX_LENGTH = getattr(settings, "FORMS_BUILDER_HELPTEXT_MAX_LENGTH", 100
 
 # The maximum allowed length for field choices
 CHOICES_MAX_LENGTH = getattr(settings, "FORMS_BUILDER_CHOICES_MAX_LENGTH", 1000)
+
+# Prefix for all keys stored in Django's cache.
+CACHE_PREFIX = getattr(settings, "FORMS_BUILDER_CACHE_PREFIX", "forms_builder")
+
+# Seconds a compiled form schema is kept in Django's cache. Schemas are
+# versioned per form, so this only bounds how long unused ones linger.
+SCHEMA_CACHE_TIMEOUT = getattr(settings,
+                               "FORMS_BUILDER_SCHEMA_CACHE_TIMEOUT", 60 * 60 * 24)
+
+# Seconds the markup of unbound forms rendered by the ``render_built_form``
+# tag is kept in Django's cache. Defaults to 0 which disables caching.
+FRAGMENT_CACHE_TIMEOUT = getattr(settings,
+                                 "FORMS_BUILDER_FRAGMENT_CACHE_TIMEOUT", 0)
+
+# Maximum seconds a published form looked up by slug is kept in Django's
+# cache. Entries also expire at the form's next publish or expiry date,
+# and are invalidated whenever any form is saved.
+PUBLISHED_CACHE_TIMEOUT = getattr(settings,
+                                  "FORMS_BUILDER_PUBLISHED_CACHE_TIMEOUT", 60 * 60)
+
+# Boolean controlling whether the values of each entry are also stored as
+# JSON on the entry, letting exports read one row per entry.
+ENTRY_DATA = getattr(settings, "FORMS_BUILDER_ENTRY_DATA", False)
+
+# Boolean controlling whether per-choice counts of choice fields are kept
+# up to date as entries are written and deleted, and used for the
+# responses page instead of counting entries.
+USE_TALLIES = getattr(settings, "FORMS_BUILDER_USE_TALLIES", False)
+
+# Seconds the responses summary of a form is cached for. Summaries are
+# keyed by the versions of the form and its entries, so any change is
+# seen on the next request. Set to 0 to disable caching.
+RESPONSES_CACHE_TIMEOUT = getattr(settings,
+                                  "FORMS_BUILDER_RESPONSES_CACHE_TIMEOUT", 60 * 60)
+
+# The number of most frequent answers shown for each text field on the
+# responses page, with further answers loaded a page at a time.
+RESPONSES_TOP_ANSWERS = getattr(settings,
+                                "FORMS_BUILDER_RESPONSES_TOP_ANSWERS", 20)
+
+# The number of bins in the histograms of number fields on the responses
+# page.
+RESPONSES_HISTOGRAM_BINS = getattr(settings,
+                                   "FORMS_BUILDER_RESPONSES_HISTOGRAM_BINS", 10)
+
+# Seconds a cached responses summary may still be shown after new entries
+# arrive, so that a burst of viewers shares one computation.
+RESPONSES_STALE_TIMEOUT = getattr(settings,
+                                  "FORMS_BUILDER_RESPONSES_STALE_TIMEOUT", 0)
+
+# Boolean controlling whether hourly and daily counts of each form's
+# entries are kept up to date as entries are written and deleted, and
+# shown as a series in the admin and on the responses page.
+USE_ROLLUPS = getattr(settings, "FORMS_BUILDER_USE_ROLLUPS", False)
+
+# Boolean controlling whether valid submissions are queued to a spool
+# directory and written to the database by the ``drain_form_submissions``
+# management command, instead of during the request.
+INGEST = getattr(settings, "FORMS_BUILDER_INGEST", False)
+
+# The absolute path of the directory holding durable queues, such as
+# queued submissions when ``INGEST`` is enabled.
+SPOOL_ROOT = getattr(settings, "FORMS_BUILDER_SPOOL_ROOT", None)
+
+# Seconds Django's cache remembers that a user has submitted a non-public
+# form, letting repeat votes be turned away without a database query.
+VOTER_CACHE_TIMEOUT = getattr(settings,
+                              "FORMS_BUILDER_VOTER_CACHE_TIMEOUT", 60 * 60 * 24)
+
+# Boolean controlling whether notification emails are rendered for each
+# submission and queued to be sent by the ``send_form_notifications``
+# management command.
+EMAIL_NOTIFICATIONS = getattr(settings, "FORMS_BUILDER_EMAIL_NOTIFICATIONS", False)
+
+# The number of times sending a notification email is attempted.
+EMAIL_MAX_ATTEMPTS = getattr(settings, "FORMS_BUILDER_EMAIL_MAX_ATTEMPTS", 5)
+
+# Seconds to wait before retrying a failed notification email, doubled
+# for each further attempt.
+EMAIL_RETRY_DELAY = getattr(settings, "FORMS_BUILDER_EMAIL_RETRY_DELAY", 60)
+
+# How receivers of the ``form_valid`` and ``form_invalid`` signals are run:
+# "sync" runs them during the request, "threaded" runs them on a pool of
+# worker threads once the submission's transaction has been committed.
+SIGNAL_DISPATCH = getattr(settings, "FORMS_BUILDER_SIGNAL_DISPATCH", "sync")
+
+# The number of worker threads running signal receivers when threaded.
+SIGNAL_THREADS = getattr(settings, "FORMS_BUILDER_SIGNAL_THREADS", 4)
+
+# The number of receiver calls that may wait for a worker thread, after
+# which receivers run during the request instead.
+SIGNAL_QUEUE_SIZE = getattr(settings, "FORMS_BUILDER_SIGNAL_QUEUE_SIZE", 1000)
+
+# Seconds after which a receiver call is logged and counted as timed out.
+SIGNAL_TIMEOUT = getattr(settings, "FORMS_BUILDER_SIGNAL_TIMEOUT", 10)
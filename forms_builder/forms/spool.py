@@ -0,0 +1,153 @@
+from __future__ import with_statement
+
+import os
+from errno import EEXIST, ENOENT
+from time import time
+from uuid import uuid4
+
+from django.core.exceptions import ImproperlyConfigured
+
+from forms_builder.forms.settings import SPOOL_ROOT
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+
+class Spool(object):
+    """
+    A durable queue of JSON records stored as files in a directory.
+
+    Records are written to ``tmp`` and then renamed into ``new``, so a
+    record is either fully queued or not at all. Consumers claim records
+    by renaming them into ``cur``, which is atomic and lets several
+    consumers share a spool without claiming the same record twice.
+    File names start with the time a record becomes available, so
+    records are claimed in order, and can be delayed for retrying.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for name in ("tmp", "new", "cur", "failed"):
+            try:
+                os.makedirs(os.path.join(path, name))
+            except OSError, e:
+                if e.errno != EEXIST:
+                    raise
+
+    def _path(self, state, name=""):
+        return os.path.join(self.path, state, name)
+
+    def put(self, record, delay=0):
+        """
+        Durably add the given record, available after ``delay`` seconds.
+        Returns the name of the record.
+        """
+        name = "%017.6f-%s.json" % (time() + delay, uuid4().hex)
+        tmp_path = self._path("tmp", name)
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self._path("new", name))
+        self._sync("new")
+        return name
+
+    def _sync(self, state):
+        """
+        Flush a rename to disk by syncing the containing directory.
+        """
+        try:
+            fd = os.open(self._path(state), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def available_at(self, name):
+        return float(name.split("-", 1)[0])
+
+    def claim(self, limit):
+        """
+        Claim up to ``limit`` available records, returning a list of
+        (name, record) pairs. Each claimed record must then be passed to
+        one of ``ack``, ``retry`` or ``fail``.
+        """
+        claimed = []
+        current = time()
+        for name in sorted(os.listdir(self._path("new"))):
+            if len(claimed) >= limit or self.available_at(name) > current:
+                break
+            try:
+                os.rename(self._path("new", name), self._path("cur", name))
+            except OSError, e:
+                if e.errno == ENOENT:
+                    # Claimed by another consumer.
+                    continue
+                raise
+            with open(self._path("cur", name), "rb") as f:
+                claimed.append((name, json.loads(f.read())))
+        return claimed
+
+    def ack(self, name):
+        """
+        Remove a claimed record once it has been processed.
+        """
+        os.remove(self._path("cur", name))
+
+    def retry(self, name, record, delay):
+        """
+        Requeue a claimed record, updated with the given record data,
+        to become available again after ``delay`` seconds.
+        """
+        self.put(record, delay)
+        self.ack(name)
+
+    def fail(self, name):
+        """
+        Move a claimed record aside into ``failed`` for inspection.
+        """
+        os.rename(self._path("cur", name), self._path("failed", name))
+
+    def recover(self):
+        """
+        Return records left claimed by a consumer that stopped before
+        processing them back to the queue. Returns the number of records
+        recovered. Only call this when no other consumers are running.
+        """
+        names = os.listdir(self._path("cur"))
+        for name in names:
+            os.rename(self._path("cur", name), self._path("new", name))
+        return len(names)
+
+    def depth(self):
+        """
+        Number of queued records, including delayed ones.
+        """
+        return len(os.listdir(self._path("new")))
+
+    def oldest_age(self):
+        """
+        Seconds since the oldest queued record became available, or
+        zero if there are none available.
+        """
+        names = os.listdir(self._path("new"))
+        if not names:
+            return 0
+        return max(0, time() - self.available_at(min(names)))
+
+
+def get_spool(name):
+    """
+    Return the spool with the given name under the ``SPOOL_ROOT``
+    setting.
+    """
+    if not SPOOL_ROOT:
+        raise ImproperlyConfigured("The FORMS_BUILDER_SPOOL_ROOT setting "
+                                   "must be defined to use spools.")
+    return Spool(os.path.join(SPOOL_ROOT, name))
@@ -0,0 +1,142 @@
+from array import array
+from collections import namedtuple
+from math import floor, isinf, isnan, sqrt
+
+from forms_builder.forms.models import FieldEntry
+
+try:
+    import numpy
+    NUMPY_INSTALLED = True
+except ImportError:
+    NUMPY_INSTALLED = False
+
+
+# The quantiles computed for number fields.
+QUANTILES = (0.25, 0.5, 0.75)
+
+NumberStats = namedtuple("NumberStats", ("count", "min", "max", "mean",
+                                         "stddev", "quantiles", "histogram"))
+
+
+def number_values(field_id, chunk_size=10000, fieldentry_model=FieldEntry):
+    """
+    Yield the values of a number field as arrays of floats, reading its
+    field entries in chunks of ``chunk_size`` rows in primary key order.
+    Values are read from the typed ``number_value`` column, falling back
+    to parsing the stored string for entries not yet backfilled, and
+    values that aren't finite numbers are skipped.
+    """
+    field_entries = fieldentry_model.objects.filter(field_id=field_id,
+        value__isnull=False).exclude(value="").order_by("id")
+    last_id = 0
+    while True:
+        rows = list(field_entries.filter(id__gt=last_id).values_list(
+            "id", "number_value", "value")[:chunk_size])
+        if not rows:
+            break
+        chunk = array("d")
+        for field_entry_id, number_value, value in rows:
+            if number_value is None:
+                try:
+                    number_value = float(value)
+                except ValueError:
+                    continue
+            if is_finite(number_value):
+                chunk.append(number_value)
+        yield chunk
+        last_id = rows[-1][0]
+
+
+def is_finite(value):
+    return not (isinf(value) or isnan(value))
+
+
+def numpy_stats(chunks, bins):
+    """
+    Compute ``NumberStats`` for chunks of values with NumPy, ignoring
+    values that aren't finite.
+    """
+    chunks = [numpy.frombuffer(chunk, dtype=numpy.float64)
+              for chunk in chunks if len(chunk)]
+    if not chunks:
+        return None
+    values = numpy.concatenate(chunks)
+    values = values[numpy.isfinite(values)]
+    if not len(values):
+        return None
+    quantiles = numpy.percentile(values, [q * 100 for q in QUANTILES])
+    counts, edges = numpy.histogram(values, bins)
+    histogram = [(float(edges[i]), float(edges[i + 1]), int(counts[i]))
+                 for i in range(len(counts))]
+    return NumberStats(len(values), float(values.min()), float(values.max()),
+                       float(values.mean()), float(values.std()),
+                       zip(QUANTILES, [float(q) for q in quantiles]),
+                       histogram)
+
+
+def python_stats(chunks, bins):
+    """
+    Compute ``NumberStats`` for chunks of values in pure Python. The
+    count, extremes, mean and standard deviation are accumulated in a
+    single pass with Welford's algorithm, and the values are kept in a
+    compact array for the quantiles and histogram. Values that aren't
+    finite are ignored. Results match those of NumPy.
+    """
+    values = array("d")
+    count = 0
+    mean = m2 = 0.0
+    low = high = None
+    for chunk in chunks:
+        chunk = array("d", filter(is_finite, chunk))
+        for value in chunk:
+            count += 1
+            delta = value - mean
+            mean += delta / count
+            m2 += delta * (value - mean)
+            if low is None or value < low:
+                low = value
+            if high is None or value > high:
+                high = value
+        values.extend(chunk)
+    if not count:
+        return None
+    values = array("d", sorted(values))
+    quantiles = []
+    for q in QUANTILES:
+        position = (count - 1) * q
+        i = int(floor(position))
+        j = min(i + 1, count - 1)
+        quantiles.append((q, values[i] + (values[j] - values[i]) *
+                          (position - i)))
+    first, last = low, high
+    if first == last:
+        first, last = first - 0.5, last + 0.5
+    width = (last - first) / bins
+    counts = [0] * bins
+    for value in values:
+        i = int((value - first) / width)
+        counts[min(i, bins - 1)] += 1
+    histogram = [(first + width * i, first + width * (i + 1), counts[i])
+                 for i in range(bins)]
+    return NumberStats(count, low, high, mean, sqrt(m2 / count), quantiles,
+                       histogram)
+
+
+def number_stats(chunks, bins=10):
+    """
+    Compute ``NumberStats`` for chunks of values, such as those yielded
+    by ``number_values``, with NumPy when installed, otherwise in pure
+    Python. Returns ``None`` if there are no values.
+    """
+    if NUMPY_INSTALLED:
+        return numpy_stats(chunks, bins)
+    return python_stats(chunks, bins)
+
+
+def field_number_stats(field_id, bins=10, fieldentry_model=FieldEntry):
+    """
+    Return ``NumberStats`` for the values of a number field, or ``None``
+    if it has no values.
+    """
+    return number_stats(number_values(field_id,
+        fieldentry_model=fieldentry_model), bins)
@@ -0,0 +1,90 @@
+from django.db.models import Count
+
+from forms_builder.forms import fields
+from forms_builder.forms.models import (FieldEntry, Tally, TALLY_TOTAL,
+                                        value_hash)
+from forms_builder.forms.utils import apply_deltas, atomic, split_selections
+
+
+def tallied_fields(form_fields):
+    """
+    Return a dict mapping IDs to fields for the given fields that are
+    tallied, which are those with a fixed set of choices.
+    """
+    return dict([(field.id, field) for field in form_fields
+                 if field.is_a(*(fields.CHOICES + fields.MULTIPLE))])
+
+
+def value_choices(field, value):
+    """
+    Return the choices counted for a stored value of a tallied field.
+    """
+    if field.is_a(*fields.MULTIPLE):
+        choices = [choice for choice, label in field.get_choices()]
+        return split_selections(value, choices)
+    return [value]
+
+
+def count_values(form_fields, rows, deltas=None, sign=1):
+    """
+    Add the tallies for ``(field_id, value, count)`` rows of stored
+    values to a dict mapping ``(field_id, choice)`` pairs to deltas,
+    returning it. Each row also counts towards the field's total, held
+    under the ``TALLY_TOTAL`` choice.
+    """
+    if deltas is None:
+        deltas = {}
+    tallied = tallied_fields(form_fields)
+    for field_id, value, count in rows:
+        field = tallied.get(field_id)
+        if field is None or not value:
+            continue
+        for choice in value_choices(field, value) + [TALLY_TOTAL]:
+            key = (field_id, choice)
+            deltas[key] = deltas.get(key, 0) + sign * count
+    return deltas
+
+
+def apply_tallies(form, deltas, tally_model=Tally):
+    """
+    Apply a dict mapping ``(field_id, choice)`` pairs to deltas to the
+    form's tallies. Tallies are looked up by the hash of their choice,
+    which is what their unique constraint covers.
+    """
+    deltas = dict([((field_id, value_hash(choice), choice), delta)
+                   for (field_id, choice), delta in deltas.items()])
+    apply_deltas(tally_model.objects.all(), ("field_id", "value_hash",
+                 "value"), deltas, {"form": form})
+
+
+def remove_entry_tallies(form, entry_ids, fieldentry_model=FieldEntry,
+                         tally_model=Tally):
+    """
+    Subtract the values of the given entries from the form's tallies,
+    before the entries are deleted.
+    """
+    rows = fieldentry_model.objects.filter(entry__in=entry_ids).values(
+        "field_id", "value").annotate(count=Count("id")).order_by()
+    rows = [(r["field_id"], r["value"], r["count"]) for r in rows]
+    deltas = count_values(form.fields.all(), rows, sign=-1)
+    apply_tallies(form, deltas, tally_model)
+
+
+def rebuild_tallies(form, fieldentry_model=FieldEntry, tally_model=Tally):
+    """
+    Recompute the form's tallies from its field entries, with a GROUP BY
+    of the values of its tallied fields.
+    """
+    form_fields = form.fields.all()
+    tallied = tallied_fields(form_fields)
+    rows = fieldentry_model.objects.filter(field_id__in=list(tallied)).values(
+        "field_id", "value").annotate(count=Count("id")).order_by()
+    rows = [(r["field_id"], r["value"], r["count"]) for r in rows]
+    deltas = count_values(form_fields, rows)
+    with atomic():
+        tally_model.objects.filter(form=form).delete()
+        tally_model.objects.bulk_create([tally_model(form=form,
+            field_id=field_id, value=choice, value_hash=value_hash(choice),
+            count=count)
+            for (field_id, choice), count in deltas.items()])
+    return len(deltas)
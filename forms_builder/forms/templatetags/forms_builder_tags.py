@@ -1,11 +1,25 @@
 from django import template
+from django.conf import settings as django_settings
+from django.core.cache import cache
 from django.template.loader import get_template
+from django.utils.encoding import force_text
+from django.utils.html import escape
+from django.utils.translation import get_language
 
+from forms_builder.forms.caching import cache_key
 from forms_builder.forms.forms import FormForForm
 from forms_builder.forms.models import Form
+from forms_builder.forms.permissions import FormPermissions
+from forms_builder.forms.schema import get_form_schema
+from forms_builder.forms.settings import FRAGMENT_CACHE_TIMEOUT
 
 register = template.Library()
 
+# Stands in for the CSRF token when rendering markup that will be
+# cached, and is replaced with the real token on every render.
+CSRF_PLACEHOLDER = "__forms_builder_csrf_token__"
+
+
 class BuiltFormNode(template.Node):
 
     def __init__(self, name, value):
@@ -22,15 +36,50 @@ class BuiltFormNode(template.Node):
                 str(self.name): template.Variable(self.value).resolve(context)
             }
             try:
-                form = Form.objects.published(for_user=user).get(**lookup)
+                if self.name == "slug":
+                    slug = lookup["slug"]
+                    form = Form.objects.get_published(slug, for_user=user)
+                else:
+                    form = Form.objects.published(for_user=user).get(**lookup)
             except Form.DoesNotExist:
                 form = None
         else:
             form = template.Variable(self.value).resolve(context)
-        if not isinstance(form, Form) or not form.is_user_permitted(request.user, 'view'):
+        if (not isinstance(form, Form) or
+                not FormPermissions(form, request.user).can_view()):
             return ""
-        t = get_template("forms/includes/built_form.html")
         context["form"] = form
+        if not FRAGMENT_CACHE_TIMEOUT or post or files:
+            return self.render_form(form, context, post, files)
+        # Unbound forms render identically for everyone in the same
+        # permission class, unless field defaults contain template code
+        # which may render per-user data.
+        schema = get_form_schema(form)
+        if any(field.default_is_template for field in schema.fields):
+            return self.render_form(form, context, post, files)
+        can_submit = bool(context.get("can_submit"))
+        key = cache_key("fragment", form.pk, schema.version,
+                        django_settings.SITE_ID, get_language(),
+                        int(can_submit))
+        html = cache.get(key)
+        if html is None:
+            context.push()
+            try:
+                context["csrf_token"] = CSRF_PLACEHOLDER
+                html = self.render_form(form, context, post, files)
+            finally:
+                context.pop()
+            cache.set(key, html, FRAGMENT_CACHE_TIMEOUT)
+        csrf_token = force_text(context.get("csrf_token") or "")
+        if csrf_token == "NOTPROVIDED":
+            csrf_token = ""
+        return html.replace(CSRF_PLACEHOLDER, escape(csrf_token))
+
+    def render_form(self, form, context, post, files):
+        """
+        Render the built form template for the given form.
+        """
+        t = get_template("forms/includes/built_form.html")
         form_args = (form, context, post or None, files or None)
         context["form_for_form"] = FormForForm(*form_args)
         return t.render(context)
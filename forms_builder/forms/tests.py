@@ -1,22 +1,29 @@
 from django.conf import settings
-from django.contrib.auth.models import User, AnonymousUser
+from django.contrib.auth.models import User, AnonymousUser, Group
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
 from django.db import IntegrityError
 from django.template import Context, RequestContext, Template
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
 from forms_builder.forms.models import (Form, Field,
-                                        STATUS_DRAFT, STATUS_PUBLISHED)
+                                        STATUS_DRAFT, STATUS_PUBLIC)
+from forms_builder.forms.models import STATUS_GROUPS, STATUS_PRIVATE
+from forms_builder.forms.models import FormEntry, FieldEntry, UserEntry
 from forms_builder.forms.fields import NAMES, FILE
 from forms_builder.forms.settings import USE_SITES
 from forms_builder.forms.signals import form_invalid, form_valid
 from forms_builder.forms.forms import FormForForm
+from forms_builder.forms.permissions import FormPermissions
 
 
 class Tests(TestCase):
 
     def setUp(self):
         self._site = Site.objects.get_current()
+        # Primary keys are reused across tests, so drop cached data.
+        cache.clear()
 
     def test_form_fields(self):
         """
@@ -24,7 +31,8 @@ class Tests(TestCase):
         both optional and required fields.
         """
         for required in (True, False):
-            form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+            form = Form.objects.create(title="Test",
+                                       can_view_status=STATUS_PUBLIC)
             if USE_SITES:
                 form.sites.add(self._site)
                 form.save()
@@ -47,7 +55,8 @@ class Tests(TestCase):
         password = "test"
         User.objects.create_superuser(username, "", password)
         self.client.logout()
-        draft = Form.objects.create(title="Draft", status=STATUS_DRAFT)
+        draft = Form.objects.create(title="Draft",
+                                    can_view_status=STATUS_DRAFT)
         if USE_SITES:
             draft.sites.add(self._site)
             draft.save()
@@ -66,7 +75,8 @@ class Tests(TestCase):
         form_invalid.connect(invalid)
         valid = lambda **kwargs: events.remove("valid")
         form_valid.connect(valid)
-        form = Form.objects.create(title="Signals", status=STATUS_PUBLISHED)
+        form = Form.objects.create(title="Signals",
+                                   can_view_status=STATUS_PUBLIC)
         if USE_SITES:
             form.sites.add(self._site)
             form.save()
@@ -82,7 +92,7 @@ class Tests(TestCase):
         Test that the different formats for the ``render_built_form``
         tag all work.
         """
-        form = Form.objects.create(title="Tags", status=STATUS_PUBLISHED)
+        form = Form.objects.create(title="Tags", can_view_status=STATUS_PUBLIC)
         request = type("Request", (), {"META": {}, "user": AnonymousUser()})()
         context = RequestContext(request, {"form": form})
         template = "{%% load forms_builder_tags %%}{%% render_built_form %s %%}"
@@ -92,7 +102,7 @@ class Tests(TestCase):
             self.assertTrue(form.get_absolute_url(), t)
 
     def test_optional_filefield(self):
-        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        form = Form.objects.create(title="Test", can_view_status=STATUS_PUBLIC)
         if USE_SITES:
             form.sites.add(self._site)
         form.save()
@@ -139,3 +149,900 @@ class Tests(TestCase):
                            required=True, visible=True)
         response = self.client.post(form.get_absolute_url(), {"foo": "bar"})
         self.assertTrue("This field is required" in response.content)
+
+    def test_schema_cache(self):
+        """
+        Test that the compiled form schema is reused across requests and
+        rebuilt when one of the form's fields changes.
+        """
+        form = Form.objects.create(title="Schema")
+        field = form.fields.create(label="field", field_type=NAMES[0][0],
+                                   required=True, visible=True)
+        FormForForm(form, Context({}))
+        with self.assertNumQueries(0):
+            form_for_form = FormForForm(form, Context({}))
+        self.assertEqual(form_for_form.fields[field.slug].label, "field")
+        field.label = "changed"
+        field.save()
+        form_for_form = FormForForm(form, Context({}))
+        self.assertEqual(form_for_form.fields[field.slug].label, "changed")
+
+    def test_fragment_cache(self):
+        """
+        Test that unbound form markup is served from the fragment cache
+        with each request's own CSRF token.
+        """
+        from forms_builder.forms.templatetags import forms_builder_tags
+        forms_builder_tags.FRAGMENT_CACHE_TIMEOUT = 60
+        try:
+            form = Form.objects.create(title="Fragment")
+            form.fields.create(label="field", field_type=NAMES[0][0])
+            template = Template("{% load forms_builder_tags %}"
+                                "{% render_built_form form %}")
+            for token in ("first", "second"):
+                request = type("Request", (), {"user": AnonymousUser(),
+                               "META": {"CSRF_COOKIE": token}})()
+                context = RequestContext(request, {"form": form})
+                if token == "first":
+                    template.render(context)
+                    continue
+                with self.assertNumQueries(0):
+                    html = template.render(context)
+                self.assertTrue("second" in html)
+                self.assertFalse("first" in html)
+        finally:
+            forms_builder_tags.FRAGMENT_CACHE_TIMEOUT = 0
+
+    def test_group_permissions(self):
+        """
+        Test that group permissions are resolved from a single query for
+        the form's groups and a single query for the user's groups.
+        """
+        user = User.objects.create_user("voter", "", "voter")
+        group = Group.objects.create(name="voters")
+        user.groups.add(group)
+        form = Form.objects.create(title="Groups",
+                                   can_view_status=STATUS_GROUPS,
+                                   can_submit_status=STATUS_GROUPS,
+                                   can_view_responses_status=STATUS_PRIVATE)
+        form.can_view_groups.add(group)
+        user = User.objects.get(id=user.id)
+        permissions = FormPermissions(form, user)
+        with self.assertNumQueries(2):
+            self.assertTrue(permissions.can_view())
+            self.assertFalse(permissions.can_submit())
+            self.assertTrue(permissions.can_view_responses())
+        self.assertFalse(FormPermissions(form, AnonymousUser()).can_view())
+
+    def test_published_cache(self):
+        """
+        Test that published forms are resolved by slug from the cache,
+        and that saving a form invalidates the cached lookup.
+        """
+        form = Form.objects.create(title="Published")
+        if USE_SITES:
+            form.sites.add(self._site)
+        Form.objects.get_published(form.slug)
+        with self.assertNumQueries(0):
+            self.assertEqual(Form.objects.get_published(form.slug), form)
+        form.can_view_status = STATUS_DRAFT
+        form.save()
+        self.assertRaises(Form.DoesNotExist, Form.objects.get_published,
+                          form.slug)
+
+    def test_save_query_count(self):
+        """
+        Test that a new entry is written with one INSERT for the entry,
+        one for the user entry, and one for all of its field entries,
+        and that a duplicate vote leaves no rows behind.
+        """
+        user = User.objects.create_user("voter", "", "voter")
+        form = Form.objects.create(title="Votes",
+                                   can_submit_status=STATUS_PRIVATE)
+        for i in range(5):
+            form.fields.create(label="field %s" % i, field_type=NAMES[0][0])
+        data = dict([(f.slug, "test") for f in form.fields.all()])
+        form_for_form = FormForForm(form, Context({}), data)
+        self.assertTrue(form_for_form.is_valid())
+        # Two more for the savepoint wrapping the nested transaction.
+        with self.assertNumQueries(5):
+            form_for_form.save(user=user)
+        form_for_form = FormForForm(form, Context({}), data)
+        self.assertTrue(form_for_form.is_valid())
+        self.assertRaises(IntegrityError, form_for_form.save, user=user)
+        self.assertEqual(form.entries.count(), 1)
+
+    def test_edit_entry(self):
+        """
+        Test that editing an entry only writes the changed field entries.
+        """
+        form = Form.objects.create(title="Edit")
+        for i in range(3):
+            form.fields.create(label="field %s" % i, field_type=NAMES[0][0])
+        data = dict([(f.slug, "test") for f in form.fields.all()])
+        form_for_form = FormForForm(form, Context({}), data)
+        self.assertTrue(form_for_form.is_valid())
+        entry = form_for_form.save()
+        data["field_1"] = "changed"
+        form_for_form = FormForForm(form, Context({}), data, instance=entry)
+        self.assertTrue(form_for_form.is_valid())
+        form_for_form.save()
+        self.assertEqual(form_for_form.rows_written, 1)
+        values = dict(entry.fields.values_list("field_id", "value"))
+        field = form.fields.get(slug="field_1")
+        self.assertEqual(values.pop(field.id), "changed")
+        self.assertEqual(set(values.values()), set(["test"]))
+
+    def test_typed_values(self):
+        """
+        Test that number, date and check box entries fill their typed
+        value columns when saved and when backfilled.
+        """
+        from datetime import date
+        from django.core.management import call_command
+        from forms_builder.forms.fields import CHECKBOX, DATE, NUMBER
+        from forms_builder.forms.models import FieldEntry, parse_typed_values
+        form = Form.objects.create(title="Typed")
+        number = form.fields.create(label="number", field_type=NUMBER)
+        day = form.fields.create(label="day", field_type=DATE)
+        checkbox = form.fields.create(label="checkbox", field_type=CHECKBOX)
+        data = {number.slug: "1.5", checkbox.slug: "on",
+                day.slug: "2014-02-03"}
+        form_for_form = FormForForm(form, Context({}), data)
+        self.assertTrue(form_for_form.is_valid())
+        entry = form_for_form.save()
+
+        def typed_values():
+            return dict([(f.field_id, (f.number_value, f.date_value,
+                                       f.bool_value))
+                         for f in entry.fields.all()])
+        expected = {number.id: (1.5, None, None),
+                    checkbox.id: (None, None, True)}
+        values = typed_values()
+        self.assertEqual(values[day.id][1].date(), date(2014, 2, 3))
+        values.pop(day.id)
+        self.assertEqual(values, expected)
+        FieldEntry.objects.update(number_value=None, date_value=None,
+                                  bool_value=None)
+        call_command("backfill_field_entries", verbosity=0)
+        values = typed_values()
+        self.assertEqual(values[day.id][1].date(), date(2014, 2, 3))
+        values.pop(day.id)
+        self.assertEqual(values, expected)
+        for value in ("inf", "-inf", "nan"):
+            typed = parse_typed_values(NUMBER, value)
+            self.assertEqual(typed["number_value"], None)
+        data[number.slug] = "nan"
+        form_for_form = FormForForm(form, Context({}), data)
+        self.assertTrue(form_for_form.is_valid())
+        entry = form_for_form.save()
+        self.assertEqual(entry.fields.get(field_id=number.id).number_value,
+                         None)
+
+    def test_entry_data(self):
+        """
+        Test that entry values stored as JSON match their field entries,
+        and that exports read both stored and backfilled entries.
+        """
+        from django.core.management import call_command
+        from forms_builder.forms import settings as forms_settings
+        from forms_builder.forms.forms import EntriesForm
+        form = Form.objects.create(title="Data")
+        for i in range(2):
+            form.fields.create(label="field %s" % i, field_type=NAMES[0][0])
+        data = dict([(f.slug, f.slug) for f in form.fields.all()])
+        entries = []
+        for entry_data in (False, True):
+            forms_settings.ENTRY_DATA = entry_data
+            try:
+                form_for_form = FormForForm(form, Context({}), data)
+                self.assertTrue(form_for_form.is_valid())
+                entries.append(form_for_form.save())
+            finally:
+                forms_settings.ENTRY_DATA = False
+        self.assertEqual(entries[0].data, None)
+        expected = dict(entries[1].fields.values_list("field_id", "value"))
+        self.assertEqual(entries[1].get_values(), expected)
+        rows = list(EntriesForm(form, None).rows(csv=True))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][:2], rows[1][:2])
+        self.assertEqual(sorted(rows[0][:2]), sorted(data.values()))
+        call_command("backfill_entry_data", verbosity=0)
+        entry = form.entries.get(id=entries[0].id)
+        self.assertEqual(entry.get_values(), expected)
+        # Field entries changed directly are refreshed on request.
+        field_entry = entry.fields.all()[0]
+        field_entry.value = "changed"
+        field_entry.save()
+        entry.refresh_data()
+        expected[field_entry.field_id] = "changed"
+        self.assertEqual(form.entries.get(id=entry.id).get_values(), expected)
+        field_entry.value = "refreshed"
+        field_entry.save()
+        call_command("backfill_entry_data", refresh=True, verbosity=0)
+        expected[field_entry.field_id] = "refreshed"
+        self.assertEqual(form.entries.get(id=entry.id).get_values(), expected)
+
+    def test_csv_export(self):
+        """
+        Test that the CSV export is streamed in an Excel compatible
+        encoding with a byte order mark.
+        """
+        from codecs import BOM_UTF16
+        User.objects.create_superuser("export", "", "export")
+        self.client.login(username="export", password="export")
+        form = Form.objects.create(title="Export")
+        field = form.fields.create(label=u"Caf\xe9", field_type=NAMES[0][0])
+        for i in range(3):
+            form_for_form = FormForForm(form, Context({}),
+                                        {field.slug: u"\xe9t\xe9 %s" % i})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        url = reverse("admin:form_entries_export", args=(form.id,))
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        content = "".join(response.streaming_content)
+        self.assertTrue(content.startswith(BOM_UTF16))
+        lines = content.decode("utf-16").splitlines()
+        self.assertEqual(lines[0].split(",")[0], u"Caf\xe9")
+        self.assertEqual(sorted([line.split(",")[0] for line in lines[1:]]),
+                         [u"\xe9t\xe9 %s" % i for i in range(3)])
+
+    def test_entry_users(self):
+        """
+        Test that the user column of exports is read with one query
+        per batch of entries.
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from forms_builder.forms.forms import EntriesForm
+        from forms_builder.forms.models import UserEntry
+        form = Form.objects.create(title="Users")
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        queries = []
+        for i in range(4):
+            user = User.objects.create_user("user%s" % i, "", "user")
+            form_for_form = FormForForm(form, Context({}), {field.slug: "x"})
+            self.assertTrue(form_for_form.is_valid())
+            entry = form_for_form.save()
+            UserEntry.objects.create(user=user, form=form, entry=entry)
+            with CaptureQueriesContext(connection) as context:
+                rows = list(EntriesForm(form, None).rows(csv=True))
+            queries.append(len(context))
+            self.assertEqual([row[-1] for row in rows],
+                             list(User.objects.order_by("-id")[:i + 1]))
+        self.assertEqual(len(set(queries)), 1)
+        entries_form = EntriesForm(form, None)
+        users = [user for _, _, _, user in
+                 entries_form.entry_values(batch_size=3, users=True)]
+        self.assertEqual(users, list(User.objects.order_by("-id")[:4]))
+
+    def test_entry_filters(self):
+        """
+        Test that filters are applied in SQL to only fetch candidate
+        entries, with the same results as checking them in Python.
+        """
+        from forms_builder.forms.fields import CHECKBOX_MULTIPLE, DATE, TEXT
+        from forms_builder.forms.forms import EntriesForm
+        from forms_builder.forms.models import Selection
+        from forms_builder.forms.utils import now
+        form = Form.objects.create(title="Filters")
+        text = form.fields.create(label="text", field_type=TEXT,
+                                  required=False)
+        multiple = form.fields.create(label="multiple",
+                                      field_type=CHECKBOX_MULTIPLE,
+                                      choices="x, y, z")
+        day = form.fields.create(label="day", field_type=DATE,
+                                 required=False)
+        entries = {}
+        for value, chosen, date in (("Apple", ["x"], "2014-02-03"),
+                                    ("apple pie", ["x", "y"], "2014-02-05"),
+                                    ("Pear", ["y", "z"], "2014-03-01"),
+                                    ("", ["z"], "")):
+            data = {text.slug: value, multiple.slug: chosen, day.slug: date}
+            form_for_form = FormForForm(form, Context({}), data)
+            self.assertTrue(form_for_form.is_valid())
+            entries[value] = form_for_form.save().id
+        form.entries.create(entry_time=now())
+        unanswered = form.entries.latest("id").id
+
+        def filtered(data):
+            entries_form = EntriesForm(form, None, FormEntry, FieldEntry,
+                                       UserEntry, data)
+            self.assertTrue(entries_form.is_valid())
+            fetched = [row[0] for row in entries_form.entry_values()]
+            ids = [row[0] for row in entries_form.rows()]
+            return sorted(fetched), sorted(ids)
+        prefix = "field_%s_" % text.id
+        fetched, ids = filtered({prefix + "filter": "1",
+                                 prefix + "contains": "APPLE"})
+        expected = sorted([entries["Apple"], entries["apple pie"],
+                           unanswered])
+        self.assertEqual((fetched, ids), (expected, expected))
+        fetched, ids = filtered({prefix + "filter": "3",
+                                 prefix + "contains": "apple"})
+        self.assertEqual(ids, sorted([entries["Apple"], unanswered]))
+        self.assertEqual(fetched, ids)
+        prefix = "field_%s_" % multiple.id
+        fetched, ids = filtered({prefix + "filter": "7",
+                                 prefix + "contains": ["y", "z"]})
+        self.assertEqual(fetched, sorted([entries["Pear"], unanswered]))
+        self.assertEqual(ids, fetched)
+        fetched, ids = filtered({prefix + "filter": "6",
+                                 prefix + "contains": ["x"]})
+        self.assertEqual(fetched, sorted([entries["Apple"],
+                                          entries["apple pie"], unanswered]))
+        self.assertEqual(ids, fetched)
+        entries_form = EntriesForm(form, None, FormEntry, FieldEntry,
+                                   UserEntry, {prefix + "filter": "6",
+                                               prefix + "contains": ["x"]})
+        self.assertTrue(entries_form.is_valid())
+        [(sql, params)] = entries_form.entry_filters()
+        self.assertTrue("OR NOT EXISTS" in sql)
+        # Entries without selections may not have been backfilled.
+        Selection.objects.filter(entry=entries["Apple"]).delete()
+        fetched, ids = filtered({prefix + "filter": "6",
+                                 prefix + "contains": ["x"]})
+        self.assertEqual(ids, sorted([entries["Apple"], entries["apple pie"],
+                                      unanswered]))
+        prefix = "field_%s_" % day.id
+        fetched, ids = filtered({prefix + "filter": "5",
+                                 prefix + "from_year": "2014",
+                                 prefix + "from_month": "2",
+                                 prefix + "from_day": "4",
+                                 prefix + "to_year": "2014",
+                                 prefix + "to_month": "3",
+                                 prefix + "to_day": "1"})
+        self.assertEqual(ids, sorted([entries["apple pie"], entries["Pear"],
+                                      unanswered]))
+        self.assertEqual(fetched, sorted(ids + [entries[""]]))
+        prefix = "field_%s_" % text.id
+        fetched, ids = filtered({prefix + "filter": "2",
+                                 prefix + "contains": "apple"})
+        self.assertEqual(len(fetched), 5)
+        self.assertEqual(ids, sorted([entries["Pear"], entries[""],
+                                      unanswered]))
+
+    def test_export_projection(self):
+        """
+        Test that partial exports only read the field entries of the
+        exported fields, including for entries with stored data.
+        """
+        from forms_builder.forms import settings as forms_settings
+        from forms_builder.forms.forms import EntriesForm
+        form = Form.objects.create(title="Projection")
+        for i in range(3):
+            form.fields.create(label="field %s" % i, field_type=NAMES[0][0])
+        form_fields = list(form.fields.all())
+        data = dict([(f.slug, f.slug) for f in form_fields])
+        for entry_data in (False, True):
+            forms_settings.ENTRY_DATA = entry_data
+            try:
+                form_for_form = FormForForm(form, Context({}), data)
+                self.assertTrue(form_for_form.is_valid())
+                form_for_form.save()
+            finally:
+                forms_settings.ENTRY_DATA = False
+        exported = form_fields[1]
+        entries_form = EntriesForm(form, None, FormEntry, FieldEntry,
+                                   UserEntry, {"field_%s_export" % exported.id:
+                                               "on"})
+        self.assertTrue(entries_form.is_valid())
+        values = [v for _, _, v, _ in entries_form.entry_values(
+            field_ids=[exported.id])]
+        self.assertEqual(values, [{exported.id: exported.slug}] * 2)
+        rows = list(entries_form.rows(csv=True))
+        self.assertEqual(rows, [(exported.slug,)] * 2)
+
+    def test_entry_batches(self):
+        """
+        Test that entries are read in batches with keyset pagination,
+        and exported by the management command.
+        """
+        import os
+        from codecs import BOM_UTF16
+        from tempfile import mkstemp
+        from django.core.management import call_command
+        from forms_builder.forms.forms import EntriesForm
+        form = Form.objects.create(title="Batches")
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        for i in range(5):
+            form_for_form = FormForForm(form, Context({}), {field.slug: i})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        entries_form = EntriesForm(form, None)
+        values = [v[field.id] for _, _, v, _ in
+                  entries_form.entry_values(batch_size=2)]
+        self.assertEqual(values, ["4", "3", "2", "1", "0"])
+        rows = list(entries_form.rows(csv=True))
+        self.assertTrue(all([isinstance(row, tuple) for row in rows]))
+        handle, path = mkstemp()
+        os.close(handle)
+        try:
+            call_command("export_form_entries", form=form.slug, output=path)
+            with open(path, "rb") as f:
+                content = f.read()
+        finally:
+            os.remove(path)
+        self.assertTrue(content.startswith(BOM_UTF16))
+        self.assertEqual(len(content.decode("utf-16").splitlines()), 6)
+
+    def test_selections(self):
+        """
+        Test that each option chosen for a multiple choice field is
+        stored as a selection, including options containing ", ", and
+        that backfilling recreates them.
+        """
+        from django.core.management import call_command
+        from forms_builder.forms.fields import CHECKBOX_MULTIPLE
+        from forms_builder.forms.models import Selection
+        form = Form.objects.create(title="Selections")
+        field = form.fields.create(label="field", field_type=CHECKBOX_MULTIPLE,
+                                   choices="a, b, `c, d`")
+        for chosen in (["a", "c, d"], ["c, d"], ["b"]):
+            form_for_form = FormForForm(form, Context({}),
+                                        {field.slug: chosen})
+            self.assertTrue(form_for_form.is_valid())
+            entry = form_for_form.save()
+        expected = {field.id: {"a": 1, "b": 1, "c, d": 2}}
+        self.assertEqual(Selection.objects.counts([field.id]), expected)
+        form_for_form = FormForForm(form, Context({}), {field.slug: ["a"]},
+                                    instance=entry)
+        self.assertTrue(form_for_form.is_valid())
+        form_for_form.save()
+        expected = {field.id: {"a": 2, "c, d": 2}}
+        self.assertEqual(Selection.objects.counts([field.id]), expected)
+        selected = Selection.objects.selected(field.id, ["b", "c, d"])
+        entries = form.entries.filter(id__in=selected.values("entry"))
+        self.assertEqual(entries.count(), 2)
+        Selection.objects.all().delete()
+        call_command("backfill_selections", verbosity=0)
+        self.assertEqual(Selection.objects.counts([field.id]), expected)
+
+    def test_responses(self):
+        """
+        Test that responses are aggregated with one query per group of
+        field types.
+        """
+        from forms_builder.forms.fields import CHECKBOX_MULTIPLE, SELECT, TEXT
+        from forms_builder.forms.responses import (aggregate_responses,
+                                                   top_answers)
+        form = Form.objects.create(title="Poll")
+        if USE_SITES:
+            form.sites.add(self._site)
+        select = form.fields.create(label="select", field_type=SELECT,
+                                    choices="a, b")
+        multiple = form.fields.create(label="multiple",
+                                      field_type=CHECKBOX_MULTIPLE,
+                                      choices="x, `y, z`")
+        text = form.fields.create(label="text", field_type=TEXT,
+                                  required=False)
+        for choice, chosen, answer in (("a", ["x"], "one"),
+                                       ("a", ["x", "y, z"], " One "),
+                                       ("b", ["y, z"], "two")):
+            data = {select.slug: choice, multiple.slug: chosen,
+                    text.slug: answer}
+            form_for_form = FormForForm(form, Context({}), data)
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        with self.assertNumQueries(5):
+            responses = list(aggregate_responses(form))
+        self.assertEqual([r.kind for r in responses],
+                         ["choice", "choice", "text"])
+        self.assertEqual([tuple(c) for c in responses[0].choices],
+                         [("a", 2, 66.67), ("b", 1, 33.33)])
+        self.assertEqual([tuple(c) for c in responses[1].choices],
+                         [("x", 2, 50.0), ("y, z", 2, 50.0)])
+        self.assertEqual([tuple(a) for a in responses[2].answers],
+                         [("One", 2), ("two", 1)])
+        answers, cursor = top_answers(text.id, 1)
+        self.assertEqual([tuple(a) for a in answers], [("One", 2)])
+        response = self.client.get(reverse("form_responses",
+                                           kwargs={"slug": form.slug}))
+        self.assertContains(response, "66.67 %")
+        response = self.client.get(reverse("form_answers",
+            kwargs={"slug": form.slug, "field_id": text.id}),
+            {"cursor": cursor})
+        self.assertContains(response, "two (1)")
+        self.assertNotContains(response, "One")
+        text.visible = False
+        text.save()
+        response = self.client.get(reverse("form_answers",
+            kwargs={"slug": form.slug, "field_id": text.id}))
+        self.assertContains(response, "One (2)")
+
+    def test_tallies(self):
+        """
+        Test that tallies are kept up to date as entries are saved,
+        edited and deleted, match a rebuild, and are used for responses.
+        """
+        from forms_builder.forms import settings as forms_settings
+        from forms_builder.forms.fields import CHECKBOX_MULTIPLE, SELECT
+        from forms_builder.forms.models import value_hash
+        from forms_builder.forms.responses import aggregate_responses
+        from forms_builder.forms.tallies import (rebuild_tallies,
+                                                 remove_entry_tallies)
+        form = Form.objects.create(title="Tallies")
+        select = form.fields.create(label="select", field_type=SELECT,
+                                    choices="a, b")
+        multiple = form.fields.create(label="multiple",
+                                      field_type=CHECKBOX_MULTIPLE,
+                                      choices="x, y")
+
+        def tallies():
+            return dict([((t.field_id, t.value), t.count)
+                         for t in form.tallies.all() if t.count])
+        forms_settings.USE_TALLIES = True
+        try:
+            entries = []
+            for choice, chosen in (("a", ["x"]), ("a", ["x", "y"]),
+                                   ("b", ["y"])):
+                data = {select.slug: choice, multiple.slug: chosen}
+                form_for_form = FormForForm(form, Context({}), data)
+                self.assertTrue(form_for_form.is_valid())
+                entries.append(form_for_form.save())
+            data = {select.slug: "b", multiple.slug: ["y"]}
+            form_for_form = FormForForm(form, Context({}), data,
+                                        instance=entries[0])
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+            expected = {(select.id, "a"): 1, (select.id, "b"): 2,
+                        (select.id, ""): 3, (multiple.id, "x"): 1,
+                        (multiple.id, "y"): 3, (multiple.id, ""): 3}
+            self.assertEqual(tallies(), expected)
+            with self.assertNumQueries(2):
+                responses = list(aggregate_responses(form))
+            self.assertEqual(responses[0].answered, 3)
+            self.assertEqual([tuple(c) for c in responses[0].choices],
+                             [("a", 1, 33.33), ("b", 2, 66.67)])
+            remove_entry_tallies(form, [entries[2].id])
+            entries[2].delete()
+            rebuilt = tallies()
+            rebuild_tallies(form)
+            self.assertEqual(tallies(), rebuilt)
+            self.assertEqual(rebuilt[(select.id, "")], 2)
+            for tally in form.tallies.all():
+                self.assertEqual(tally.value_hash, value_hash(tally.value))
+        finally:
+            forms_settings.USE_TALLIES = False
+
+    def test_rollups(self):
+        """
+        Test that submission rollups are kept up to date as entries are
+        saved and deleted, match a rebuild, and are zero-filled in series.
+        """
+        from datetime import timedelta
+        from forms_builder.forms import settings as forms_settings
+        from forms_builder.forms.fields import TEXT
+        from forms_builder.forms.models import ROLLUP_DAY, ROLLUP_HOUR
+        from forms_builder.forms.rollups import (rebuild_rollups,
+                                                 remove_entry_rollups,
+                                                 rollup_series)
+        from forms_builder.forms.utils import now
+        form = Form.objects.create(title="Rollups")
+        field = form.fields.create(label="field", field_type=TEXT)
+
+        def rollups():
+            return sorted([(r.period, r.start, r.count)
+                           for r in form.rollups.all() if r.count])
+        forms_settings.USE_ROLLUPS = True
+        try:
+            entries = []
+            for i in range(3):
+                form_for_form = FormForForm(form, Context({}),
+                                            {field.slug: str(i)})
+                self.assertTrue(form_for_form.is_valid())
+                entries.append(form_for_form.save())
+            form_for_form = FormForForm(form, Context({}), {field.slug: "x"},
+                                        instance=entries[0])
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+            self.assertEqual([count for _, _, count in rollups()], [3, 3])
+            daily = rollup_series(form)
+            self.assertEqual(len(daily), 30)
+            self.assertEqual([count for _, count in daily], [0] * 29 + [3])
+            hourly = rollup_series(form, ROLLUP_HOUR, 48)
+            self.assertEqual(hourly[-1][1], 3)
+            remove_entry_rollups(form, [entries[2].id])
+            entries[2].delete()
+            entries[1].entry_time = now() - timedelta(days=2)
+            entries[1].save()
+            rebuild_rollups(form)
+            daily = rollup_series(form, ROLLUP_DAY, 3)
+            self.assertEqual([count for _, count in daily], [1, 0, 1])
+            self.assertEqual(len(rollups()), 4)
+        finally:
+            forms_settings.USE_ROLLUPS = False
+
+    def test_responses_cache(self):
+        """
+        Test that the responses summary is cached until a new entry is
+        saved, and revalidated with ETags.
+        """
+        from forms_builder.forms import settings as forms_settings
+        from forms_builder.forms.fields import SELECT
+        form = Form.objects.create(title="Cached")
+        if USE_SITES:
+            form.sites.add(self._site)
+        field = form.fields.create(label="select", field_type=SELECT,
+                                   choices="a, b")
+        url = reverse("form_responses", kwargs={"slug": form.slug})
+
+        def vote(choice):
+            form_for_form = FormForForm(form, Context({}),
+                                        {field.slug: choice})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        vote("a")
+        response = self.client.get(url)
+        self.assertContains(response, "a - 1 - 100.0 %")
+        etag = response["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        vote("b")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "b - 1 - 50.0 %")
+        self.assertNotEqual(response["ETag"], etag)
+        etag = response["ETag"]
+        forms_settings.RESPONSES_STALE_TIMEOUT = 60
+        try:
+            vote("b")
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        finally:
+            forms_settings.RESPONSES_STALE_TIMEOUT = 0
+        # Versions are still issued when the cache doesn't keep them.
+        from django.core.cache.backends.dummy import DummyCache
+        from forms_builder.forms import caching
+        caching.cache = DummyCache("dummy", {})
+        try:
+            response = self.client.get(url)
+            self.assertContains(response, "b - 2 - 66.67 %")
+        finally:
+            caching.cache = cache
+
+    def test_number_stats(self):
+        """
+        Test the statistics of number fields against known values.
+        """
+        from array import array
+        from forms_builder.forms.fields import NUMBER
+        from forms_builder.forms.stats import (field_number_stats,
+                                               python_stats)
+        stats = python_stats([array("d", [1, 2, 3]), array("d", [4])], 3)
+        self.assertEqual(stats.count, 4)
+        self.assertEqual((stats.min, stats.max, stats.mean), (1, 4, 2.5))
+        self.assertAlmostEqual(stats.stddev, 1.118033988)
+        self.assertEqual(stats.quantiles, [(0.25, 1.75), (0.5, 2.5),
+                                           (0.75, 3.25)])
+        self.assertEqual([h[2] for h in stats.histogram], [1, 1, 2])
+        form = Form.objects.create(title="Numbers")
+        field = form.fields.create(label="number", field_type=NUMBER)
+        for value in ("2", "4", "inf", "nan"):
+            form_for_form = FormForForm(form, Context({}),
+                                        {field.slug: value})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        # Non-finite values stored before they were excluded from the
+        # typed column are also skipped.
+        FieldEntry.objects.filter(field_id=field.id).update(number_value=None)
+        stats = field_number_stats(field.id)
+        self.assertEqual((stats.count, stats.mean, stats.stddev), (2, 3, 1))
+        stats = python_stats([array("d", [1, float("inf"), float("nan")])], 2)
+        self.assertEqual((stats.count, stats.min, stats.max), (1, 1, 1))
+        if USE_SITES:
+            form.sites.add(self._site)
+        response = self.client.get(reverse("form_responses",
+                                           kwargs={"slug": form.slug}))
+        self.assertContains(response, "50th percentile")
+
+    def test_ingest(self):
+        """
+        Test that queued submissions are written by the drainer, which
+        discards repeat votes from the same user.
+        """
+        from shutil import rmtree
+        from tempfile import mkdtemp
+        from forms_builder.forms.ingest import (enqueue_submission,
+                                                SubmissionDrainer)
+        from forms_builder.forms import spool
+        spool.SPOOL_ROOT = mkdtemp()
+        try:
+            user = User.objects.create_user("voter", "", "voter")
+            form = Form.objects.create(title="Ingest",
+                                       can_submit_status=STATUS_PRIVATE)
+            field = form.fields.create(label="field", field_type=NAMES[0][0])
+            form_for_form = FormForForm(form, Context({}),
+                                        {field.slug: "test"})
+            self.assertTrue(form_for_form.is_valid())
+            enqueue_submission(form_for_form, user)
+            self.assertRaises(IntegrityError, enqueue_submission,
+                              form_for_form, user)
+            # A repeat vote queued before the first one was recorded.
+            drainer = SubmissionDrainer()
+            name, record = drainer.spool.claim(1)[0]
+            drainer.spool.retry(name, record, 0)
+            drainer.spool.put(record)
+            # Another user's vote queued after the repeat vote.
+            other = User.objects.create_user("other", "", "other")
+            enqueue_submission(form_for_form, other)
+            self.assertEqual(drainer.stats()["depth"], 3)
+            sent = []
+            receiver = lambda entry, **kwargs: sent.append(entry.id)
+            # Receivers written for requests fail with the drainer as
+            # the sender, without stopping the batch or other receivers.
+            failing = lambda sender, **kwargs: sender.user
+            form_valid.connect(failing)
+            form_valid.connect(receiver)
+            try:
+                result = drainer.drain()
+            finally:
+                form_valid.disconnect(failing)
+                form_valid.disconnect(receiver)
+            self.assertEqual((result.drained, result.duplicates), (2, 1))
+            self.assertEqual(drainer.stats()["depth"], 0)
+            entries = form.entries.order_by("id")
+            self.assertEqual(sorted(sent), [e.id for e in entries])
+            for entry in entries:
+                self.assertEqual(entry.fields.get().value, "test")
+        finally:
+            rmtree(spool.SPOOL_ROOT)
+            spool.SPOOL_ROOT = None
+
+    def test_repeat_vote(self):
+        """
+        Test that a repeat voter is detected from the cache before the
+        form is bound, and that deleting their vote lets them vote again.
+        """
+        from forms_builder.forms.permissions import has_user_submitted
+        User.objects.create_user("voter", "", "voter")
+        self.client.login(username="voter", password="voter")
+        form = Form.objects.create(title="Vote",
+                                   can_submit_status=STATUS_PRIVATE)
+        if USE_SITES:
+            form.sites.add(self._site)
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        data = {field.slug: "test"}
+        response = self.client.post(form.get_absolute_url(), data=data)
+        self.assertTrue(response["Location"].endswith("success/"))
+        response = self.client.get(form.get_absolute_url())
+        self.assertTrue(response.context["already_submitted"])
+        self.assertFalse(response.context["can_submit"])
+        response = self.client.post(form.get_absolute_url(), data=data)
+        self.assertTrue(response["Location"].endswith("error/"))
+        self.assertEqual(form.entries.count(), 1)
+        user = User.objects.get(username="voter")
+        with self.assertNumQueries(0):
+            self.assertTrue(has_user_submitted(form, user))
+        form.userentry_set.all().delete()
+        self.assertFalse(has_user_submitted(form, user))
+
+    def test_notifications(self):
+        """
+        Test that notification emails are rendered when queued and sent
+        in a batch by the sender.
+        """
+        from shutil import rmtree
+        from tempfile import mkdtemp
+        from django.core import mail
+        from forms_builder.forms import settings as forms_settings
+        from forms_builder.forms.fields import EMAIL
+        from forms_builder.forms.notifications import (queue_notifications,
+                                                       NotificationSender)
+        from forms_builder.forms import spool
+        spool.SPOOL_ROOT = mkdtemp()
+        try:
+            form = Form.objects.create(title="Notify",
+                                       email_copies="staff@example.com",
+                                       email_message="Thanks & <regards>")
+            field = form.fields.create(label="Email", field_type=EMAIL)
+            request = type("Request", (), {"META": {}, "user": AnonymousUser(),
+                           "get_host": lambda self: "example.com"})()
+            form_for_form = FormForForm(form, Context({}),
+                                        {field.slug: "user@example.com"})
+            self.assertTrue(form_for_form.is_valid())
+            self.assertEqual(queue_notifications(form_for_form, request), 2)
+            result = NotificationSender().send()
+            self.assertEqual(result.sent, 2)
+            self.assertEqual(len(mail.outbox), 2)
+            self.assertEqual(mail.outbox[0].to, ["user@example.com"])
+            self.assertEqual(mail.outbox[1].from_email, "user@example.com")
+            self.assertTrue("user@example.com" in mail.outbox[1].body)
+            self.assertTrue("Thanks & <regards>" in mail.outbox[0].body)
+        finally:
+            rmtree(spool.SPOOL_ROOT)
+            spool.SPOOL_ROOT = None
+        # Submissions still succeed when notifications can't be queued.
+        forms_settings.EMAIL_NOTIFICATIONS = True
+        try:
+            if USE_SITES:
+                form.sites.add(self._site)
+            response = self.client.post(form.get_absolute_url(),
+                                        {field.slug: "user@example.com"})
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(form.entries.count(), 1)
+        finally:
+            forms_settings.EMAIL_NOTIFICATIONS = False
+
+    def test_threaded_signals(self):
+        """
+        Test that threaded dispatch runs receivers on the pool once the
+        request's transaction is committed, not at all if it's rolled
+        back, and in the calling thread inside other transactions,
+        isolating their errors, while synchronous receivers run straight
+        away.
+        """
+        from threading import current_thread
+        from django.core.signals import (got_request_exception,
+                                         request_finished, request_started)
+        from forms_builder.forms import dispatch
+        threads = {}
+        def slow(sender, **kwargs):
+            threads["slow"] = current_thread()
+            raise ValueError("Errors are logged, not raised")
+        @dispatch.synchronous
+        def inline(sender, **kwargs):
+            threads["inline"] = current_thread()
+        form_valid.connect(slow)
+        form_valid.connect(inline)
+        dispatch.settings.SIGNAL_DISPATCH = "threaded"
+        dispatch.metrics.clear()
+        try:
+            # Tests run in a transaction, standing in for the request's.
+            request_started.send(sender=None)
+            dispatch.send(form_valid, sender=None, form=None, entry=None)
+            self.assertEqual(threads.keys(), ["inline"])
+            got_request_exception.send(sender=None, request=None)
+            request_finished.send(sender=None)
+            dispatch.pool.join()
+            self.assertEqual(threads.keys(), ["inline"])
+            request_started.send(sender=None)
+            dispatch.send(form_valid, sender=None, form=None, entry=None)
+            request_finished.send(sender=None)
+            dispatch.pool.join()
+            self.assertNotEqual(threads["slow"], current_thread())
+            # Outside of a request, the transaction's outcome isn't known.
+            dispatch.send(form_valid, sender=None, form=None, entry=None)
+            self.assertEqual(threads["slow"], current_thread())
+        finally:
+            dispatch.settings.SIGNAL_DISPATCH = "sync"
+            form_valid.disconnect(slow)
+            form_valid.disconnect(inline)
+        self.assertEqual(threads["inline"], current_thread())
+        stats = dispatch.metrics.snapshot()
+        self.assertEqual(stats[__name__ + ".slow"]["errors"], 2)
+
+
+class TransactionTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_version_bumped_after_commit(self):
+        """
+        Test that a form's version is issued again once the transaction
+        changing it is committed, so that a schema read from another
+        connection before the commit isn't served afterwards.
+        """
+        from django.core.signals import request_finished
+        from forms_builder.forms.caching import (cache_key,
+                                                 flush_version_bumps,
+                                                 get_form_version)
+        from forms_builder.forms.schema import compile_schema, get_form_schema
+        from forms_builder.forms.utils import atomic
+        form = Form.objects.create(title="Versions")
+        field = form.fields.create(label="field", field_type=NAMES[0][0])
+        committed = compile_schema(form)
+        with atomic():
+            field.label = "changed"
+            field.save()
+            # Another connection still reads the committed rows, and
+            # caches them under the version just issued.
+            version = get_form_version(form)
+            cache.set(cache_key("schema", form.pk, version), committed)
+            flush_version_bumps()
+            self.assertEqual(get_form_version(form), version)
+        request_finished.send(sender=self.__class__)
+        self.assertNotEqual(get_form_version(form), version)
+        schema = get_form_schema(form)
+        self.assertEqual([spec.label for spec in schema.fields], ["changed"])
@@ -4,6 +4,11 @@ from forms_builder.forms import views
 
 urlpatterns = patterns("forms_builder.forms.views",
 
+    url(r"(?P<slug>.*)/responses/(?P<field_id>\d+)/$",
+        view=views.FormAnswersView.as_view(),
+        name="form_answers"
+        ),
+
     url(r"(?P<slug>.*)/responses/$",
         view=views.FormResponsesView.as_view(),
         name="form_responses"
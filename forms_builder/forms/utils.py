@@ -1,4 +1,10 @@
+from codecs import getincrementalencoder
+from csv import writer
+from itertools import chain
 
+from django.db import IntegrityError, connections, router
+from django.db.transaction import atomic
+from django.db.models import F, Q
 from django.template.defaultfilters import slugify as django_slugify
 from unidecode import unidecode
 
@@ -41,3 +47,158 @@ def split_choices(choices_string):
     Convert a comma separated choices string to a list.
     """
     return filter(None, [x.strip() for x in choices_string.split(",")])
+
+
+def split_selections(value, choices):
+    """
+    Split a stored multiple choice value into the options it contains.
+    Options are joined with ", " when stored, so the parts are matched
+    against the field's choices, preferring the longest choice at each
+    position so that choices containing ", " are kept whole.
+    """
+    parts = value.split(", ")
+    choices = set(choices)
+    selections = []
+    i = 0
+    while i < len(parts):
+        for j in range(len(parts), i, -1):
+            option = ", ".join(parts[i:j])
+            if option in choices or j == i + 1:
+                break
+        selections.append(option.strip())
+        i = j
+    return filter(None, selections)
+
+
+def exists(queryset, field_name, model):
+    """
+    Return the SQL and params of an ``EXISTS`` test for rows of the
+    given queryset whose ``field_name`` foreign key references the row
+    of ``model`` in the outer query, for use with ``extra(where=...)``.
+    Unlike ``id__in`` subqueries, negating it gives a ``NOT EXISTS``
+    anti-join, which every backend plans as well as ``EXISTS``.
+    """
+    connection = connections[queryset.db]
+    qn = connection.ops.quote_name
+    opts = queryset.model._meta
+    where = "%s.%s = %s.%s" % (qn(opts.db_table),
+        qn(opts.get_field(field_name).column), qn(model._meta.db_table),
+        qn(model._meta.pk.column))
+    query = queryset.extra(where=[where]).order_by().values("pk").query
+    sql, params = query.get_compiler(connection=connection).as_sql()
+    return "EXISTS (%s)" % sql, tuple(params)
+
+
+def bulk_update(model, rows, field_names, batch_size=300):
+    """
+    Update the given fields of many rows of the given model, where
+    ``rows`` maps each primary key to a dict of field values. Each batch
+    of rows is written with a single UPDATE statement using a CASE
+    expression per field, which all supported backends understand.
+    Returns the number of rows updated.
+    """
+    if not rows:
+        return 0
+    opts = model._meta
+    db = router.db_for_write(model)
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    pk_column = qn(opts.pk.column)
+    pks = list(rows)
+    updated = 0
+    for i in range(0, len(pks), batch_size):
+        batch = pks[i:i + batch_size]
+        assignments = []
+        params = []
+        for name in field_names:
+            field = opts.get_field(name)
+            column = qn(field.column)
+            placeholder = "%s"
+            if connection.vendor == "postgresql":
+                # Parameters in a CASE are otherwise typed as text.
+                placeholder = "%%s::%s" % field.db_type(connection)
+            cases = []
+            for pk in batch:
+                value = field.get_db_prep_save(rows[pk][name], connection)
+                cases.append("WHEN %%s THEN %s" % placeholder)
+                params.extend([pk, value])
+            assignments.append("%s = CASE %s %s ELSE %s END" % (column,
+                pk_column, " ".join(cases), column))
+        params.extend(batch)
+        sql = "UPDATE %s SET %s WHERE %s IN (%s)" % (qn(opts.db_table),
+            ", ".join(assignments), pk_column, ", ".join(["%s"] * len(batch)))
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        updated += cursor.rowcount
+    return updated
+
+
+def apply_deltas(queryset, key_names, deltas, create_kwargs=None):
+    """
+    Add amounts to the ``count`` field of rows of the given queryset,
+    where ``deltas`` maps tuples of values for the ``key_names`` fields
+    to amounts. Rows sharing an amount are updated together with a
+    single UPDATE using an atomic ``F()`` expression, so that concurrent
+    writers never lose counts. Rows missing for positive amounts are
+    created along with ``create_kwargs``, falling back to an update if
+    created concurrently.
+    """
+    by_amount = {}
+    for key, amount in deltas.items():
+        if amount:
+            by_amount.setdefault(amount, []).append(key)
+    for amount, keys in by_amount.items():
+        with atomic():
+            query = Q()
+            for key in keys:
+                query |= Q(**dict(zip(key_names, key)))
+            rows = queryset.filter(query)
+            updated = rows.update(count=F("count") + amount)
+            if updated == len(keys) or amount < 0:
+                continue
+            existing = set(rows.values_list(*key_names))
+            for key in keys:
+                if key in existing:
+                    continue
+                lookup = dict(zip(key_names, key))
+                try:
+                    with atomic():
+                        queryset.create(count=amount, **dict(lookup,
+                                        **(create_kwargs or {})))
+                except IntegrityError:
+                    queryset.filter(**lookup).update(
+                        count=F("count") + amount)
+
+
+class _Line(object):
+    """
+    A file-like object for ``csv.writer`` that returns each line written
+    rather than storing it.
+    """
+
+    def write(self, line):
+        return line
+
+
+def csv_stream(columns, rows, delimiter=",", encoding="utf-16",
+               chunk_size=65536):
+    """
+    Yield the CSV of the given column names and rows of UTF-8 encoded
+    values as chunks of around ``chunk_size`` bytes in the given
+    encoding. Lines are re-encoded one at a time with an incremental
+    encoder, which writes the byte order mark of encodings such as
+    ``utf-16`` or ``utf-8-sig`` once at the start, so memory use doesn't
+    grow with the number of rows.
+    """
+    csv = writer(_Line(), delimiter=delimiter)
+    encode = getincrementalencoder(encoding)().encode
+    lines = []
+    size = 0
+    for row in chain([columns], rows):
+        lines.append(csv.writerow(row).decode("utf-8"))
+        size += len(lines[-1])
+        if size >= chunk_size:
+            yield encode(u"".join(lines))
+            lines = []
+            size = 0
+    yield encode(u"".join(lines), True)
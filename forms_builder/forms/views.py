@@ -1,59 +1,119 @@
+import logging
+
+from django.core.exceptions import ImproperlyConfigured
 from django.core.urlresolvers import reverse
 from django.db import IntegrityError
-from django.http import Http404
-from django.shortcuts import get_object_or_404, redirect
+from django.http import Http404, HttpResponseNotModified
+from django.shortcuts import redirect
 from django.template import RequestContext
+from django.utils.cache import patch_cache_control
+from django.utils.http import (http_date, parse_etags, parse_http_date_safe,
+                               quote_etag)
 from django.views.generic import View
 from django.views.generic.base import TemplateResponseMixin, ContextMixin
 from forms_builder.forms import settings
+from forms_builder.forms.dispatch import send
 from forms_builder.forms.forms import FormForForm
+from forms_builder.forms.ingest import enqueue_submission
+from forms_builder.forms.notifications import queue_notifications
+from forms_builder.forms.responses import (compute_responses,
+                                           get_cached_responses,
+                                           responses_etag, responses_versions,
+                                           top_answers)
 from forms_builder.forms.signals import form_invalid, form_valid
-from forms_builder.forms.models import Form
+from forms_builder.forms.models import Field, Form, STATUS_PUBLIC
+from forms_builder.forms.permissions import (FormPermissions,
+                                             has_user_submitted,
+                                             mark_user_submitted)
 from forms_builder.forms.fields import *
 
 
+logger = logging.getLogger("forms_builder")
+
+
+def get_published_form_or_404(request, slug):
+    """
+    Return the published form for the given slug, via the cached
+    ``FormManager.get_published`` lookup.
+    """
+    try:
+        return Form.objects.get_published(slug, for_user=request.user)
+    except Form.DoesNotExist:
+        raise Http404
+
+
+def already_submitted(request, form):
+    """
+    Redirect to the error page for a user that has already submitted
+    the form.
+    """
+    err = "You have already voted for this"
+    request.session['form_submitted'] = True
+    request.session['form_error'] = err
+    return redirect(reverse("form_error", kwargs={"slug": form.slug}))
+
+
 class FormDetailView(TemplateResponseMixin, ContextMixin, View):
     template_name = 'forms/form_detail.html'
 
     def get(self, request, slug):
-        published = Form.objects.published(for_user=request.user)
-        form = get_object_or_404(published, slug=slug)
+        form = get_published_form_or_404(request, slug)
+        permissions = FormPermissions(form, request.user)
 
-        if not form.is_user_permitted(request.user, 'view'):
+        if not permissions.can_view():
             raise Http404
 
-        context = self.get_context_data(form=form, can_submit=form.is_user_permitted(request.user, 'submit'))
+        submitted = has_user_submitted(form, request.user)
+        can_submit = permissions.can_submit() and not submitted
+        context = self.get_context_data(form=form, can_submit=can_submit,
+                                        already_submitted=submitted)
         return self.render_to_response(context)
 
     def post(self, request, slug):
-        published = Form.objects.published(for_user=request.user)
-        form = get_object_or_404(published, slug=slug)
+        form = get_published_form_or_404(request, slug)
+        permissions = FormPermissions(form, request.user)
 
-        if not form.is_user_permitted(request.user, 'submit'):
+        if not permissions.can_submit():
             raise Http404
 
+        # Turn away repeat votes before binding the form.
+        if has_user_submitted(form, request.user):
+            return already_submitted(request, form)
+
         request_context = RequestContext(request)
         args = (form, request_context, request.POST or None, request.FILES or None)
         form_for_form = FormForForm(*args)
 
         if not form_for_form.is_valid():
-            form_invalid.send(sender=request, form=form_for_form)
+            send(form_invalid, sender=request, form=form_for_form)
         else:
             try:
-                entry = form_for_form.save(user=request.user)
+                if settings.INGEST:
+                    # Written and signalled by drain_form_submissions.
+                    enqueue_submission(form_for_form, request.user)
+                else:
+                    entry = form_for_form.save(user=request.user)
             except IntegrityError:
-                err = "You have already voted for this"
-                request.session['form_submitted'] = True
-                request.session['form_error'] = err
-                return redirect(reverse("form_error", kwargs={"slug": form.slug}))
+                mark_user_submitted(form, request.user)
+                return already_submitted(request, form)
             except:
                 raise
 
-            form_valid.send(sender=request, form=form_for_form, entry=entry)
+            mark_user_submitted(form, request.user)
+            if not settings.INGEST:
+                send(form_valid, sender=request, form=form_for_form, entry=entry)
+            if settings.EMAIL_NOTIFICATIONS:
+                # The submission is already saved, so a missing or
+                # unwritable spool shouldn't fail the request.
+                try:
+                    queue_notifications(form_for_form, request)
+                except (ImproperlyConfigured, EnvironmentError):
+                    logger.exception("Couldn't queue notifications for "
+                                     "the form %s" % form.slug)
             request.session['form_submitted'] = True;
             return redirect(reverse("form_success", kwargs={"slug": form.slug}))
 
-        context = self.get_context_data(form=form, can_submit=form.is_user_permitted(request.user, 'submit'))
+        context = self.get_context_data(form=form, can_submit=True)
         return self.render_to_response(context)
 
 
@@ -63,8 +123,7 @@ class FormSuccessView(TemplateResponseMixin, ContextMixin, View):
     def get(self, request, slug):
         if not request.session.pop('form_submitted', False):
             raise Http404
-        published = Form.objects.published(for_user=request.user)
-        form = get_object_or_404(published, slug=slug)
+        form = get_published_form_or_404(request, slug)
 
         context = self.get_context_data(form=form)
         return self.render_to_response(context)
@@ -76,8 +135,7 @@ class FormErrorView(TemplateResponseMixin, ContextMixin, View):
     def get(self, request, slug):
         if not request.session.pop('form_submitted', False) or not request.session.pop('form_error', False):
             raise Http404
-        published = Form.objects.published(for_user=request.user)
-        form = get_object_or_404(published, slug=slug)
+        form = get_published_form_or_404(request, slug)
 
         context = self.get_context_data(form=form, error=request.session.pop('form_error'))
         return self.render_to_response(context)
@@ -87,60 +145,68 @@ class FormResponsesView(TemplateResponseMixin, ContextMixin, View):
     template_name = 'forms/form_responses.html'
 
     def get(self, request, slug):
-        published = Form.objects.published(for_user=request.user)
-        form = get_object_or_404(published, slug=slug)
+        form = get_published_form_or_404(request, slug)
 
-        if not form.is_user_permitted(request.user, 'responses'):
+        if not FormPermissions(form, request.user).can_view_responses():
             raise Http404
 
-        resp = dict()
-
-        # Join responses for each field
-        for e in form.fields.all():
-            resp[e] = [[j for j in i.fields.all() if j.field_id == e.id][0] for i in form.entries.all()]
-
-        # Make html from responses
-        for r in resp:
-            s = ""
-            if r.field_type in TEXTS or r.field_type in DATES:
-                for e in resp[r]:
-                    if e.value is None or len(e.value.replace('\n', '').replace('\r', '').strip()) == 0: continue
-                    tmp = '<span class="ans-container">' + e.value.strip() + '</span>'
-                    if s.find(tmp) == -1:
-                        s += tmp
-
-            elif r.field_type in CHOICES or r.field_type in MULTIPLE:
-                if r.field_type == CHECKBOX:
-                    choices = {'True': 0, 'False': 0}
-                else:
-                    choices = {i[0]: 0 for i in r.get_choices()}
-
-                total = 0.0
-                for e in resp[r]:
-                    try:
-                        val = e.value.split(', ')
-                        for v in val:
-                            choices[v] += 1
-                            total += 1
-                    except KeyError:
-                        pass
-
-                for e in choices:
-                    if total == 0:
-                        s += e + ' - ' + str(choices[e]) + ' - 0<br>'
-                    else:
-                        s += e + ' - ' + str(choices[e]) + ' - ' + str(round((choices[e] / total * 100), 2)) + ' %<br>'
-            else:
-                total = 0
-                for e in resp[r]:
-                    if e.value is not None:
-                        total += 1
-                s += u'Total Count of Files Uploaded: {0:d}'.format(total)
-
-            resp[r] = s
-
-        # Sort
-        resp = sorted([i for i in resp.iteritems()], key=lambda t: t[0].order)
-
-        context = self.get_context_data(form=form, responses=resp)
+        # The summary is cached, and revalidated by clients and proxies
+        # with an ETag of the form and entry versions it was computed
+        # from, so unchanged responses can be answered with a 304
+        # without computing or rendering anything.
+        cached = get_cached_responses(form)
+        if cached is None:
+            versions = responses_versions(form)
+        else:
+            versions = cached.versions
+        etag = responses_etag(versions)
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if_modified_since = request.META.get("HTTP_IF_MODIFIED_SINCE")
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            if etag in etags or "*" in etags:
+                return HttpResponseNotModified()
+        elif cached is not None and if_modified_since:
+            if_modified_since = parse_http_date_safe(if_modified_since)
+            if if_modified_since >= int(cached.computed_at):
+                return HttpResponseNotModified()
+        if cached is None:
+            cached = compute_responses(form, versions)
+        context = self.get_context_data(form=form,
+                                        responses=cached.responses)
+        response = self.render_to_response(context)
+        response["ETag"] = quote_etag(etag)
+        response["Last-Modified"] = http_date(cached.computed_at)
+        if form.can_view_responses_status != STATUS_PUBLIC:
+            patch_cache_control(response, private=True)
+        return response
+
+
+class FormAnswersView(TemplateResponseMixin, ContextMixin, View):
+    """
+    A page of the most frequent answers to a text field of a form, as a
+    fragment loaded by the responses page for answers past the first
+    page, starting at the ``cursor`` query parameter.
+    """
+
+    template_name = 'forms/includes/form_answers.html'
+
+    def get(self, request, slug, field_id):
+        form = get_published_form_or_404(request, slug)
+
+        if not FormPermissions(form, request.user).can_view_responses():
+            raise Http404
+
+        try:
+            field = form.fields.get(id=field_id)
+        except Field.DoesNotExist:
+            raise Http404
+        if field.is_a(*(CHOICES + MULTIPLE + (FILE,))):
+            raise Http404
+        answers, next_cursor = top_answers(field.id,
+                                           settings.RESPONSES_TOP_ANSWERS,
+                                           request.GET.get("cursor"))
+        context = self.get_context_data(form=form, field=field,
+                                        answers=answers,
+                                        next_cursor=next_cursor)
         return self.render_to_response(context)